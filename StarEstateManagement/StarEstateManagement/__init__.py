@@ -1,4 +1,9 @@
+import os
+
 from pymysql import install_as_MySQLdb
 
 
-install_as_MySQLdb()
\ No newline at end of file
+# 数据库驱动，默认使用纯python实现的pymysql，环境变量DB_DRIVER=mysqlclient时使用C扩展驱动mysqlclient
+# 驱动需要在django加载mysql后端之前确定，此时配置文件尚未加载，因此通过环境变量选择
+if os.environ.get('DB_DRIVER', 'pymysql') != 'mysqlclient':
+    install_as_MySQLdb()
@@ -20,3 +20,8 @@ application = ProtocolTypeRouter({
     'http': get_asgi_application(),
     'websocket': URLRouter(routing.websocket_urlpatterns)
 })
+
+# 应用加载完成后启动定时任务
+from star_api.tasks import start_scheduler  # noqa: E402
+
+start_scheduler()
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'StarEstateManagement.settings')
 
 application = get_wsgi_application()
+
+# 应用加载完成后启动定时任务
+from star_api.tasks import start_scheduler  # noqa: E402
+
+start_scheduler()
@@ -6,7 +6,7 @@ done
 
 python3 manage.py makemigrations&&
 python3 manage.py migrate&&
-coproc glances -w --disable-webui &&
+python3 manage.py rebuild_comment_path&&
 uwsgi --ini uwsgi.ini -d uwsgi.log&&
 tail -f /dev/null
 exec "$@"
@@ -0,0 +1,191 @@
+from django.db.models import F, Q
+from django.http import JsonResponse
+from rest_framework import status
+from rest_framework.exceptions import NotFound
+from star_db.models import User, Publicity, Message, House, Parking
+from utils.async_redis import get_async_redis
+from utils.custom_pagination import CommentsPagination
+from utils.response_cache import aget_cached_data, not_modified
+from utils.user_auth import aget_token_user
+from .serializer import UserModelSerializers, PublicitySerializers, MessageSerializers
+
+# 首页公示列表返回的字段
+HOME_PUBLICITY_FIELDS = ('id', 'img', 'type', 'title', 'good', 'create_time')
+# 消息列表返回的字段
+MESSAGE_FIELDS = ('id', 'recipient_name', 'create_time', 'content')
+
+
+def api_response(data, status_code=status.HTTP_200_OK):
+    '''
+    按CustomRenderer的格式封装响应数据，与同步接口的返回格式保持一致
+    :param data: 响应数据
+    :param status_code: 响应码
+    :return: JSON数据响应对象
+    '''
+    code = 1 if status_code >= 400 or data.get('code') else 0
+    return JsonResponse({'code': code, 'msg': 'error' if code else 'success', 'data': data}, status=status_code,
+                        json_dumps_params={'ensure_ascii': False})
+
+
+async def authenticate(request):
+    '''
+    根据请求头中的token获取当前用户，只允许GET请求，校验顺序与同步接口一致
+    :param request: 请求对象
+    :return: 用户对象和校验失败时的响应对象
+    '''
+    key = request.META.get('HTTP_AUTHORIZATION', '').split()
+    if len(key) != 2 or key[0].lower() != 'token':
+        return None, api_response({'detail': 'Authentication credentials were not provided.'},
+                                  status.HTTP_401_UNAUTHORIZED)
+    user = await aget_token_user(key[1])
+    if user is None:
+        return None, api_response({'detail': 'Invalid token.'}, status.HTTP_401_UNAUTHORIZED)
+    if request.method != 'GET':
+        return None, api_response({'detail': f'Method "{request.method}" not allowed.'},
+                                  status.HTTP_405_METHOD_NOT_ALLOWED)
+    return user, None
+
+
+async def get_info(request):
+    '''
+    根据token获取用户个人信息，异步版本
+    :param request: 请求对象
+    :return: 包含用户信息的JSON数据响应对象
+    '''
+    user, error = await authenticate(request)
+    if error:
+        return error
+    try:
+        instance = await User.objects.aget(username=user.username)
+    except User.DoesNotExist:
+        return api_response({'detail': 'Not found.'}, status.HTTP_404_NOT_FOUND)
+    serializer = UserModelSerializers()
+    # 预先查询住址和车位，序列化时不再访问数据库
+    serializer.house_map = {instance.id: await House.objects.filter(username_id=instance.id).
+                            values_list('house_id', flat=True).afirst()}
+    serializer.parking_map = {instance.id: await Parking.objects.filter(username_id=instance.id).
+                              values_list('parking_lot_id', flat=True).afirst()}
+    return api_response(serializer.to_representation(instance))
+
+
+async def serialize_home_publicity(queryset):
+    '''
+    序列化首页公示列表，点赞数通过一次异步redis管道批量获取
+    :param queryset: 公示查询集
+    :return: 序列化后的数据列表
+    '''
+    instances = [obj async for obj in queryset.only('id', 'img', 'type', 'title', 'create_time')]
+    serializer = PublicitySerializers(fields=HOME_PUBLICITY_FIELDS)
+    pipe = get_async_redis().pipeline(transaction=False)
+    for obj in instances:
+        pipe.bitcount(f'publicity{obj.id}')
+    serializer.good_map = dict(zip([obj.id for obj in instances], await pipe.execute())) if instances else {}
+    return [serializer.to_representation(obj) for obj in instances]
+
+
+async def build_activity():
+    '''
+    生成首页社区活动数据
+    :return: 响应数据
+    '''
+    return {'code': 0, 'list': await serialize_home_publicity(Publicity.objects.filter(type=1))}
+
+
+async def build_notice():
+    '''
+    生成首页通知公告数据
+    :return: 响应数据
+    '''
+    return {'code': 0, 'list': await serialize_home_publicity(Publicity.objects.filter(~Q(type=1)))}
+
+
+async def build_activity_list():
+    '''
+    生成可报名活动列表数据
+    :return: 响应数据
+    '''
+    queryset = Publicity.objects.filter(Q(type=1) & Q(join__lt=F('need'))).values('id', 'title')
+    return {'code': 0, 'list': [item async for item in queryset]}
+
+
+async def cached_response(request, name, build):
+    '''
+    返回按公示数据版本缓存的响应，与同步接口共用缓存和ETag
+    :param request: 请求对象
+    :param name: 接口名称
+    :param build: 缓存未命中时生成响应数据的协程函数
+    :return: JSON数据响应对象，数据未变化时为304响应
+    '''
+    etag, data = await aget_cached_data(request, name, Publicity, build)
+    if data is None:
+        return not_modified(etag)
+    response = api_response(data)
+    response['ETag'] = etag
+    return response
+
+
+async def get_activity(request):
+    '''
+    获取首页社区活动内容数据，异步版本
+    :param request: 请求对象
+    :return: 包含社区活动信息的JSON数据响应对象
+    '''
+    user, error = await authenticate(request)
+    if error:
+        return error
+    return await cached_response(request, 'publicity_activity', build_activity)
+
+
+async def get_notice(request):
+    '''
+    获取首页通知公告内容数据，异步版本
+    :param request: 请求对象
+    :return: 包含通知公告信息的JSON数据响应对象
+    '''
+    user, error = await authenticate(request)
+    if error:
+        return error
+    return await cached_response(request, 'publicity_notice', build_notice)
+
+
+async def get_activity_list(request):
+    '''
+    获取可报名活动列表，异步版本
+    :param request: 请求对象
+    :return: 包含可报名活动信息的JSON数据响应对象
+    '''
+    user, error = await authenticate(request)
+    if error:
+        return error
+    return await cached_response(request, 'publicity_list', build_activity_list)
+
+
+async def get_messages(request):
+    '''
+    获取当前用户接收的消息，异步版本，传入游标时按游标分页返回
+    :param request: 请求对象
+    :return: 包含消息信息的JSON数据响应对象
+    '''
+    user, error = await authenticate(request)
+    if error:
+        return error
+    queryset = Message.objects.filter(recipient_id=user.username).only('id', *MESSAGE_FIELDS)
+    serializer = MessageSerializers(fields=MESSAGE_FIELDS)
+    paginator = CommentsPagination()
+    if paginator.cursor_query_param not in request.GET:
+        return api_response({'code': 0, 'list': [serializer.to_representation(obj) async for obj in queryset]})
+    page_size = paginator.get_cursor_page_size(request.GET)
+    queryset = queryset.order_by(*paginator.ordering)
+    cursor = request.GET.get(paginator.cursor_query_param)
+    try:
+        if cursor:
+            queryset = queryset.filter(paginator.get_position_filter(Message, paginator.decode_cursor(cursor)))
+    except NotFound as e:
+        return api_response({'detail': str(e.detail)}, status.HTTP_404_NOT_FOUND)
+    # 多取一条判断是否还有下一页
+    results = [obj async for obj in queryset[:page_size + 1]]
+    page = results[:page_size]
+    return api_response({
+        'list': [serializer.to_representation(obj) for obj in page],
+        'next': paginator.encode_cursor(page[-1]) if len(results) > page_size else None
+    })
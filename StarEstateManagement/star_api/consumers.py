@@ -1,60 +1,118 @@
-import requests
+import asyncio
+import datetime
+import os
+
 import ujson
-from apscheduler.schedulers.background import BackgroundScheduler
-from channels.generic.websocket import WebsocketConsumer
-from channels.exceptions import StopConsumer
-
-
-class ServiceData(WebsocketConsumer):
-    scheduler = BackgroundScheduler()
-
-    def send_service_data(self):
-        # 保存服务器运行数据
-        with open('server_data.txt', 'a', encoding='utf-8') as f:
-            # 获取当前时间、cpu使用率、内存使用率
-            time = requests.get('http://localhost:61208/api/3/now')[17:19]
-            cpu = requests.get('http://localhost:61208/api/3/cpu/total')[10:14]
-            mem = requests.get('http://localhost:61208/api/3/mem/percent')[12:16]
-            # 写入一条数据
-            if time and cpu and mem:
-                f.write(f'时间:{time}\tCPU使用率:{cpu}\t内存使用率:{mem}\n')
-                # 编写响应体
-                data = {
-                    'time': time,
-                    'cpu': cpu,
-                    'mem': mem
-                }
-                # 返回数据
-                self.send(text_data=ujson.dumps(data))
-
-    def websocket_connect(self, message):
+from channels.generic.websocket import AsyncWebsocketConsumer
+from channels.layers import get_channel_layer
+from utils.metrics_store import CpuSampler, sample_server
+
+# 服务器数据采集间隔(秒)
+SAMPLE_INTERVAL = 10
+# 当前进程的广播组，每个进程只向自己的连接广播本进程采集的数据，避免多进程重复推送
+SERVER_DATA_GROUP = f'server_data_{os.getpid()}'
+
+
+class ServerDataSampler(object):
+    """
+    服务器数据采集器，每个进程只运行一个采集任务，有连接时启动，连接全部断开后停止
+    """
+
+    def __init__(self, group, interval):
+        self.group = group
+        self.interval = interval
+        self.subscribers = 0
+        self.task = None
+        self.cpu_sampler = None
+
+    def subscribe(self):
         '''
-        客户端向服务端发送连接请求时触发
-        :param message:
+        新增连接，第一个连接建立时启动采集任务
+        :return:
+        '''
+        self.subscribers += 1
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+
+    def unsubscribe(self):
+        '''
+        断开连接，没有连接时取消采集任务
+        :return:
+        '''
+        self.subscribers = max(self.subscribers - 1, 0)
+        if not self.subscribers and self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def sample(self):
+        '''
+        获取当前时间、cpu使用率、内存使用率
+        :return: 服务器数据
+        '''
+        cpu, mem = sample_server(self.cpu_sampler)
+        return {
+            'time': datetime.datetime.now().strftime('%H:%M:%S'),
+            'cpu': f'{cpu:.1f}',
+            'mem': f'{mem:.1f}'
+        }
+
+    async def run(self):
+        '''
+        定时采集服务器数据并广播给当前进程的所有连接
         :return:
         '''
+        channel_layer = get_channel_layer()
+        # 使用独立的cpu采集器，不影响定时任务的采样区间，创建时确定计算起点
+        self.cpu_sampler = CpuSampler()
+        while True:
+            await asyncio.sleep(self.interval)
+            await channel_layer.group_send(self.group, {'type': 'server.data', 'data': self.sample()})
+
 
-        # 接收请求，创建连接
-        self.accept()
-        # 创建定时任务，每10s执行一次
-        self.scheduler.add_job(self.send_service_data, 'interval', seconds=10)
-        # 开始定时任务
-        self.scheduler.start()
+sampler = ServerDataSampler(SERVER_DATA_GROUP, SAMPLE_INTERVAL)
 
-    def websocket_receive(self, message):
+
+class ServiceData(AsyncWebsocketConsumer):
+    # 当前连接是否已订阅采集器
+    subscribed = False
+
+    async def connect(self):
+        '''
+        客户端向服务端发送连接请求时触发
+        :return:
+        '''
+        # 加入广播组并接收请求，创建连接
+        await self.channel_layer.group_add(SERVER_DATA_GROUP, self.channel_name)
+        await self.accept()
+        sampler.subscribe()
+        self.subscribed = True
+
+    async def receive(self, text_data=None, bytes_data=None):
         '''
         客户端向服务端发送信息时触发
-        :param message:
+        :param text_data: 文本数据
+        :param bytes_data: 二进制数据
         :return:
         '''
         # 如果接收到客户端的exit则说明要断开连接
-        if message.get('text') == 'exit':
-            self.close()
+        if text_data == 'exit':
+            await self.close()
+
+    async def disconnect(self, code):
+        '''
+        客户端断开连接时触发，退出广播组
+        :param code: 关闭码
+        :return:
+        '''
+        await self.channel_layer.group_discard(SERVER_DATA_GROUP, self.channel_name)
+        if self.subscribed:
+            sampler.unsubscribe()
+            self.subscribed = False
 
-    def websocket_disconnect(self, message):
+    async def server_data(self, event):
         '''
-        客户端自动断开连接时触发
-        :param message:
+        接收采集器广播的服务器数据并发送给客户端
+        :param event: 广播消息
         :return:
         '''
-        raise StopConsumer()
+        await self.send(text_data=ujson.dumps(event['data']))
@@ -0,0 +1,101 @@
+import decimal
+import json
+import timeit
+from collections import OrderedDict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from star_api.serializer import CommentsSerializers, PaymentSerializers
+from star_db.models import User, Comments, Payment
+from utils import response_render
+from utils.response_render import CustomRenderer
+
+
+class Response(object):
+    """
+    渲染时只需要响应码
+    """
+    status_code = 200
+
+
+# 渲染上下文
+RENDER_CONTEXT = {'response': Response()}
+# 与DRF默认编码格式不同的数据，ujson输出1e-7，DRF(json模块)输出1e-07
+FORMAT_CASES = [
+    ('小数指数', {'code': 0, 'value': 1e-7}),
+    ('大数指数', {'code': 0, 'value': 1e20}),
+]
+
+
+def seed(count):
+    '''
+    填充评论和收费记录
+    :param count: 每张表填充的行数
+    :return:
+    '''
+    users = User.objects.bulk_create([User(username=f'bench_render_{index}', name=f'测试{index}')
+                                      for index in range(3)])
+    Comments.objects.bulk_create([
+        Comments(username=users[index % 3], page_id=1, type=0, father_id=0, comment=f'评论内容 {index} /a')
+        for index in range(count)
+    ], batch_size=1000)
+    Payment.objects.bulk_create([
+        Payment(username=users[index % 3], name=f'缴费{index}', type=index % 4, money=decimal.Decimal('12.30') + index)
+        for index in range(count)
+    ], batch_size=1000)
+
+
+def render(data, fast):
+    '''
+    使用CustomRenderer渲染分页数据
+    :param data: 响应数据
+    :param fast: 是否使用ujson编码
+    :return: 渲染结果
+    '''
+    response_render.FAST_JSON_RENDER = fast
+    return CustomRenderer().render(data, None, RENDER_CONTEXT)
+
+
+class Command(BaseCommand):
+    help = '对比CustomRenderer使用ujson编码前后渲染评论和收费列表的耗时，并检查两种编码的输出是否一致'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000, help='每个列表的数据条数')
+        parser.add_argument('--number', type=int, default=50, help='每种情况的渲染次数')
+
+    def handle(self, *args, **options):
+        number = options['number']
+        fast_setting = response_render.FAST_JSON_RENDER
+        mismatched = []
+        try:
+            with transaction.atomic():
+                seed(options['rows'])
+                cases = [
+                    ('评论列表', CommentsSerializers(Comments.objects.all()[:options['rows']], many=True).data),
+                    ('收费列表', PaymentSerializers(Payment.objects.all()[:options['rows']], many=True).data),
+                ]
+                # 填充的数据只用于生成渲染数据，执行后回滚
+                transaction.set_rollback(True)
+            for name, results in cases:
+                data = OrderedDict([('count', len(results)), ('results', results)])
+                fast, default = render(data, True), render(data, False)
+                if fast != default:
+                    mismatched.append(name)
+                result = {}
+                for enabled in (False, True):
+                    result[enabled] = min(timeit.repeat(lambda: render(data, enabled), number=number,
+                                                        repeat=5)) / number * 1000
+                self.stdout.write(f'{name}({len(results)}条): json {result[False]:.2f}ms, '
+                                  f'ujson {result[True]:.2f}ms, 输出{"一致" if fast == default else "不一致"}')
+            # 浮点数的指数格式不同，只要求解析后的数据一致
+            for name, data in FORMAT_CASES:
+                fast, default = render(dict(data), True), render(dict(data), False)
+                same = json.loads(fast) == json.loads(default)
+                if not same:
+                    mismatched.append(name)
+                self.stdout.write(f'{name}: ujson {fast.decode()}, json {default.decode()}, '
+                                  f'解析后{"一致" if same else "不一致"}')
+        finally:
+            response_render.FAST_JSON_RENDER = fast_setting
+        if mismatched:
+            raise CommandError(f'ujson编码与DRF默认编码不一致: {mismatched}')
@@ -0,0 +1,44 @@
+import timeit
+
+from django.core.management.base import BaseCommand
+from star_api.serializer import PublicitySerializers, UserModelSerializers, ParkingSerializers
+from utils.custom_serializer import DynamicFieldsModelSerializer
+
+# 高频接口使用的序列化器及字段集合，字段为None表示全部字段
+BENCH_CASES = [
+    ('首页公示', PublicitySerializers, ('id', 'img', 'type', 'title', 'good', 'create_time')),
+    ('活动参与进度', PublicitySerializers, ('title', 'join', 'need')),
+    ('用户姓名', UserModelSerializers, ('id', 'name')),
+    ('车位列表', ParkingSerializers, None),
+]
+
+
+def instantiate(serializer_class, fields, cached):
+    '''
+    实例化序列化器并获取字段，模拟一次请求中的序列化器构建
+    :param serializer_class: 序列化器类
+    :param fields: 字段集合
+    :param cached: 是否使用字段缓存，不使用时每次清空缓存以重新构建全部字段
+    :return: 字段字典
+    '''
+    if not cached:
+        DynamicFieldsModelSerializer._fields_cache.clear()
+    return serializer_class(fields=fields).fields
+
+
+class Command(BaseCommand):
+    help = '对比DynamicFieldsModelSerializer使用字段缓存前后每次实例化的耗时'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--number', type=int, default=3000, help='每种情况的实例化次数')
+
+    def handle(self, *args, **options):
+        number = options['number']
+        for name, serializer_class, fields in BENCH_CASES:
+            result = {}
+            for cached in (False, True):
+                instantiate(serializer_class, fields, cached)
+                result[cached] = min(timeit.repeat(lambda: instantiate(serializer_class, fields, cached),
+                                                   number=number, repeat=3)) / number * 1e6
+            self.stdout.write(f'{name}({serializer_class.__name__}): 不缓存 {result[False]:.1f}us, '
+                              f'缓存 {result[True]:.1f}us, 每次节省 {result[False] - result[True]:.1f}us')
@@ -1,8 +1,12 @@
+import datetime
+
 from rest_framework import serializers
 from django.contrib.auth.hashers import make_password
 from django.core.cache import cache
+from django.utils import timezone
 from utils.constant import REDIS_CLIENT
-from utils.custom_serializer import DynamicFieldsModelSerializer
+from utils.data_version import bump_version
+from utils.custom_serializer import DynamicFieldsModelSerializer, PrefetchListSerializer
 from star_db.models import User, ActivityApply, Publicity, RepairsApply, UserService, Evaluate, Comments, \
     Payment, UserPayment, Parking, House, Message
 
@@ -11,9 +15,13 @@ class UserModelSerializers(DynamicFieldsModelSerializer):
     """ 用户信息序列化器 """
     address = serializers.SerializerMethodField(label='住址')
     parking = serializers.SerializerMethodField(label='车位')
+    # 整页预取的用户id与房屋号、车位号映射，未预取时为None
+    house_map = None
+    parking_map = None
 
     class Meta:
         model = User  # 获取User的字段数据格式
+        list_serializer_class = PrefetchListSerializer
         fields = ['id', 'username', 'status', 'avatar', 'create_time', "name",
                   'group', 'update_time', 'sex', 'id_num', 'phone', 'message',
                   'address', 'parking', 'check_in', 'password', 'info_complete']
@@ -48,15 +56,35 @@ class UserModelSerializers(DynamicFieldsModelSerializer):
             validated_data['password'] = make_password(validated_data.get('password'))
         return super().update(instance, validated_data)
 
+    def prefetch(self, instances):
+        """
+        批量获取整页用户的房屋号和车位号
+        :param instances: 当前页的用户对象列表
+        :return:
+        """
+        id_list = [obj.id for obj in instances]
+        # 只有需要返回住址或车位时才查询，每类数据整页只查询一次
+        if 'address' in self.fields:
+            self.house_map = dict(House.objects.filter(username_id__in=id_list).values_list('username_id', 'house_id'))
+        if 'parking' in self.fields:
+            self.parking_map = dict(Parking.objects.filter(username_id__in=id_list).
+                                    values_list('username_id', 'parking_lot_id'))
+
     # 自定义方法字段
     def get_address(self, obj):
         if isinstance(obj, User) or obj.get('id'):
+            # 如果已整页预取则直接从映射中获取
+            if self.house_map is not None:
+                return self.house_map.get(obj.id)
             user_house = House.objects.filter(username_id=obj.id).first()
             return user_house.house_id if user_house else None
         return None
 
     def get_parking(self, obj):
         if isinstance(obj, User) or obj.get('id'):
+            # 如果已整页预取则直接从映射中获取
+            if self.parking_map is not None:
+                return self.parking_map.get(obj.id)
             user_parking = Parking.objects.filter(username_id=obj.id).first()
             return user_parking.parking_lot_id if user_parking else None
         return None
@@ -72,6 +100,7 @@ class ActivityApplySerializers(DynamicFieldsModelSerializer):
 
     class Meta:
         model = ActivityApply
+        list_serializer_class = PrefetchListSerializer
         fields = [
             'id', 'p_name', 'p_join', 'p_need', 'user_name', 'user_id', 'status',
             'username', 'publicity', 'create_time', 'update_time'
@@ -82,27 +111,94 @@ class PublicitySerializers(DynamicFieldsModelSerializer):
     user_id = serializers.CharField(source='username.username', read_only=True)
     user_name = serializers.CharField(source='username.name', read_only=True)
     good = serializers.SerializerMethodField(label='文章点赞数')
+    is_good = serializers.SerializerMethodField(label='当前用户是否点赞')
     all = serializers.SerializerMethodField(label='社区总人数')
+    # 整页预取的点赞数、当前用户点赞状态和社区总人数，未预取时为None
+    good_map = None
+    is_good_map = None
+    all_user = None
 
     class Meta:
         model = Publicity
+        list_serializer_class = PrefetchListSerializer
         fields = ['id', 'user_id', 'user_name', 'type', 'title', 'content', 'status', 'create_time',
-                  'img', 'title', 'good', 'join', 'need', 'money', 'all', 'username', 'start', 'end', 'address'
+                  'img', 'title', 'good', 'is_good', 'join', 'need', 'money', 'all', 'username', 'start', 'end',
+                  'address'
                   ]
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # 截止日期已过但尚未被定时任务更新状态的公示按已过期返回
+        if data.get('status') is False and 'end' not in instance.get_deferred_fields() and instance.end:
+            now = timezone.now() if timezone.is_aware(instance.end) else datetime.datetime.utcnow()
+            if instance.end < now:
+                data['status'] = True
+        return data
+
+    def get_user_pk(self):
+        """
+        获取当前请求用户的id
+        :return: 用户id，未登录时为None
+        """
+        request = self.context.get('request')
+        return getattr(getattr(request, 'user', None), 'pk', None)
+
+    def prefetch(self, instances):
+        """
+        通过一次redis管道批量获取整页通知的点赞数和当前用户的点赞状态
+        :param instances: 当前页的通知对象列表
+        :return:
+        """
+        need_good = 'good' in self.fields
+        user_pk = self.get_user_pk() if 'is_good' in self.fields else None
+        if need_good or user_pk is not None:
+            pipe = REDIS_CLIENT.pipeline(transaction=False)
+            for obj in instances:
+                if need_good:
+                    pipe.bitcount(f'publicity{obj.id}')
+                if user_pk is not None:
+                    pipe.getbit(f'publicity{obj.id}', user_pk)
+            result = iter(pipe.execute())
+            good_map, is_good_map = {}, {}
+            for obj in instances:
+                if need_good:
+                    good_map[obj.id] = next(result)
+                if user_pk is not None:
+                    is_good_map[obj.id] = next(result)
+            self.good_map = good_map if need_good else None
+            self.is_good_map = is_good_map if user_pk is not None else None
+        # 社区总人数整页只获取一次
+        if 'all' in self.fields:
+            self.all_user = cache.get_or_set('all_user', 0)
+
     def get_good(self, obj):
         """
         根据通知id从redis中获取点赞数
         :param obj:当前实例对象
         :return:
         """
+        if self.good_map is not None:
+            return self.good_map.get(obj.id, 0)
         return REDIS_CLIENT.bitcount(f'publicity{obj.id}')
 
+    def get_is_good(self, obj):
+        """
+        从redis中获取当前用户是否已点赞
+        :param obj:当前实例对象
+        :return:
+        """
+        if self.is_good_map is not None:
+            return self.is_good_map.get(obj.id, 0)
+        user_pk = self.get_user_pk()
+        return REDIS_CLIENT.getbit(f'publicity{obj.id}', user_pk) if user_pk is not None else 0
+
     def get_all(self, obj):
         """
         从redis中获取社区总人数
         :return:
         """
+        if self.all_user is not None:
+            return self.all_user
         return cache.get_or_set('all_user', 0)
 
 
@@ -112,6 +208,7 @@ class RepairsApplySerializers(DynamicFieldsModelSerializer):
 
     class Meta:
         model = RepairsApply
+        list_serializer_class = PrefetchListSerializer
         fields = [
             'id', 'name', 'type', 'user_name', 'user_id', 'status', 'username_id',
             'username', 'create_time', 'worker_name', 'worker_id', 'update_time'
@@ -123,12 +220,16 @@ class RepairsApplySerializers(DynamicFieldsModelSerializer):
             queryset = User.objects.filter(id=validated_data.get('worker_id'))
             if queryset:
                 queryset.update(task_id=validated_data.get('id'))
+                bump_version(User)
                 validated_data['worker_name'] = queryset.first().name
         # 如果没有传入工人id则将说明任务已完成
         else:
             User.objects.filter(id=instance.worker_id).update(task_id=0)
+            bump_version(User)
         # 更新用户维修记录数据状态
         UserService.objects.filter(order_id=instance.id).update(status=validated_data.get('status'))
+        # update不会触发模型信号，需要手动更新数据版本
+        bump_version(UserService)
         return super().update(instance, validated_data)
 
 
@@ -138,44 +239,48 @@ class UserServiceSerializers(DynamicFieldsModelSerializer):
 
     class Meta:
         model = UserService
+        list_serializer_class = PrefetchListSerializer
         fields = [
             'id', 'user_name', 'user_id', 'name', 'type',
             'status', 'score', 'order_id', 'create_time'
         ]
 
 
-class EvaluateSerializers(serializers.ModelSerializer):
+class EvaluateSerializers(DynamicFieldsModelSerializer):
     user_name = serializers.CharField(source='username.name', read_only=True)
     user_id = serializers.CharField(source='username.username', read_only=True)
 
     class Meta:
         model = Evaluate
+        list_serializer_class = PrefetchListSerializer
         fields = [
             'id', 'name', 'user_name', 'user_id', 'type', 'score', 'weekday',
             'username', 'content', 'status', 'create_time', 'record_id'
         ]
 
 
-class CommentsSerializers(serializers.ModelSerializer):
+class CommentsSerializers(DynamicFieldsModelSerializer):
     user_id = serializers.CharField(source='username.username')
     user_name = serializers.CharField(source='username.name')
     user_avatar = serializers.CharField(source='username.avatar')
 
     class Meta:
         model = Comments
+        list_serializer_class = PrefetchListSerializer
         fields = [
             'id', 'user_name', 'user_id', 'user_avatar', 'replay_name', 'comment', 'type', 'page_name', 'page_id',
             'status', 'father_id', 'create_time', 'show', 'good'
         ]
 
 
-class PaymentSerializers(serializers.ModelSerializer):
+class PaymentSerializers(DynamicFieldsModelSerializer):
     user_name = serializers.CharField(source='username.name', read_only=True)
     user_id = serializers.CharField(source='username.username', read_only=True)
     user_phone = serializers.CharField(source='username.phone', read_only=True)
 
     class Meta:
         model = Payment
+        list_serializer_class = PrefetchListSerializer
         fields = [
             'id', 'username', 'user_name', 'user_id', 'name', 'type', 'status',
             'user_phone', 'money', 'create_time'
@@ -188,6 +293,7 @@ class UserPaymentSerializers(DynamicFieldsModelSerializer):
 
     class Meta:
         model = UserPayment
+        list_serializer_class = PrefetchListSerializer
         fields = [
             'id', 'user_name', 'username', 'name', 'user_id', 'money', 'status',
             'type', 'order_id', 'create_time', 'score', 'update_time'
@@ -204,6 +310,7 @@ class ParkingSerializers(DynamicFieldsModelSerializer):
 
     class Meta:
         model = Parking
+        list_serializer_class = PrefetchListSerializer
         fields = [
             'id', "username", 'user_name', 'user_id', 'id_num', 'phone', "parking_lot_id", "money",
             'payment', "create_time", "status", "order_id", "update_time"
@@ -220,6 +327,7 @@ class HouseSerializers(DynamicFieldsModelSerializer):
 
     class Meta:
         model = House
+        list_serializer_class = PrefetchListSerializer
         fields = [
             'id', "username", 'user_name', 'user_id', 'id_num', 'phone', "house_id", "money",
             'payment', "create_time", "status", "order_id", "update_time"
@@ -231,6 +339,7 @@ class MessageSerializers(DynamicFieldsModelSerializer):
 
     class Meta:
         model = Message
+        list_serializer_class = PrefetchListSerializer
         fields = [
             'id', 'username', 'recipient_id', 'recipient_name', 'content', 'create_time', 'user_id'
         ]
@@ -0,0 +1,134 @@
+import datetime
+import time
+from functools import wraps
+
+from apscheduler.schedulers.background import BackgroundScheduler
+from django.db import close_old_connections
+from utils.constant import REDIS_CLIENT
+from utils.counter import call_counter
+from utils.data_version import bump_version
+from utils.metrics_store import METRICS_INTERVAL, CpuSampler, sample_server, record_sample
+from star_db.backends.mysql_pool.pool import reap_pools
+from star_db.models import User, Publicity, Payment, UserPayment
+
+# 每个进程共用一个后台定时任务调度器
+scheduler = BackgroundScheduler()
+# 收费通知标题中的款项名与费用类型的对应关系
+PAYMENT_TYPE = {'水费': 0, '电费': 1, '物业费': 2, '燃气费': 3}
+# 服务器数据定时采样使用的cpu采集器，与websocket实时推送的采集器互不影响
+cpu_sampler = CpuSampler()
+
+
+def run_once(name, timeout):
+    '''
+    多个进程同时触发定时任务时只允许一个进程执行
+    :param name: 任务名
+    :param timeout: 任务锁的有效时间
+    :return: 装饰器
+    '''
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            # 抢占任务锁失败说明其他进程已经执行了本次任务
+            if not REDIS_CLIENT.set(f'task_lock:{name}', 1, nx=True, ex=timeout):
+                return None
+            close_old_connections()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                close_old_connections()
+        return wrapper
+    return decorator
+
+
+def create_month_bills(user_id_list=None):
+    '''
+    根据本月的收费通知为用户批量生成待缴费记录
+    :param user_id_list: 需要生成账单的用户id列表，为空时为全部用户生成
+    :return: 新生成的账单数
+    '''
+    now = datetime.datetime.utcnow()
+    # 获取本月收费款项的标题和金额，同名款项只生成一次
+    notices = dict(Publicity.objects.filter(create_time__year=now.year, create_time__month=now.month, type=2).
+                   values_list('title', 'money'))
+    if not notices:
+        return 0
+    title_list = list(notices)
+    user_payment = UserPayment.objects.filter(name__in=title_list)
+    payment = Payment.objects.filter(name__in=title_list)
+    if user_id_list is None:
+        user_id_list = list(User.objects.values_list('id', flat=True))
+    else:
+        user_payment = user_payment.filter(username_id__in=user_id_list)
+        payment = payment.filter(username_id__in=user_id_list)
+    # 已有前台待缴费款项或后台缴费记录的用户不再生成
+    exists = set(user_payment.values_list('username_id', 'name')) | set(payment.values_list('username_id', 'name'))
+    bills = [
+        UserPayment(username_id=user_id, money=money, name=title,
+                    type=PAYMENT_TYPE.get(title[title.find('份') + 1:], 0))
+        for title, money in notices.items() for user_id in user_id_list if (user_id, title) not in exists
+    ]
+    UserPayment.objects.bulk_create(bills, batch_size=1000)
+    # bulk_create不会触发模型信号，需要手动更新数据版本
+    if bills:
+        bump_version(UserPayment)
+    return len(bills)
+
+
+@run_once('month_bills', 60 * 50)
+def month_bills_task():
+    '''
+    定时补全本月账单，覆盖发布通知后新注册的用户
+    :return:
+    '''
+    create_month_bills()
+
+
+@run_once('publicity_expire', 60 * 9)
+def publicity_expire_task():
+    '''
+    将截止日期已过的公示设置为1即过期状态，点赞位图过期后使首页缓存失效
+    :return:
+    '''
+    # 只更新尚未过期的公示，已过期的不再重复写入
+    expired = Publicity.objects.filter(status=0, end__lt=datetime.datetime.utcnow()).update(status=1)
+    # 点赞位图在截止日期7天后过期，过期时点赞数归零但不会触发数据版本更新，需要检查上次执行后是否有位图过期
+    now = time.time()
+    checked = float(REDIS_CLIENT.getset('publicity_like_checked', now) or now)
+    # 与设置位图过期时间的方式一致，按本地时间计算截止日期
+    like_expired = Publicity.objects.filter(
+        end__gt=datetime.datetime.fromtimestamp(checked) - datetime.timedelta(weeks=1),
+        end__lte=datetime.datetime.fromtimestamp(now) - datetime.timedelta(weeks=1)
+    ).exists()
+    if expired or like_expired:
+        bump_version(Publicity)
+
+
+@run_once('metrics_sample', METRICS_INTERVAL - 1)
+def metrics_sample_task():
+    '''
+    采集服务器cpu和内存使用率并写入环形缓冲区，多个进程中只有一个进程写入
+    :return:
+    '''
+    record_sample(*sample_server(cpu_sampler))
+
+
+def start_scheduler():
+    '''
+    注册并启动定时任务，每个进程只启动一次
+    :return:
+    '''
+    if scheduler.running:
+        return
+    scheduler.add_job(month_bills_task, 'interval', hours=1, id='month_bills', replace_existing=True)
+    # 每个进程定期写入自己缓冲的调用次数
+    scheduler.add_job(call_counter.flush, 'interval', seconds=call_counter.interval, id='flush_counter',
+                      replace_existing=True)
+    scheduler.add_job(publicity_expire_task, 'interval', minutes=10, id='publicity_expire', replace_existing=True)
+    # 重新确定cpu使用率的计算起点
+    cpu_sampler.percent()
+    scheduler.add_job(metrics_sample_task, 'interval', seconds=METRICS_INTERVAL, id='metrics_sample',
+                      replace_existing=True)
+    # 每个进程回收自己连接池中空闲超时的数据库连接
+    scheduler.add_job(reap_pools, 'interval', seconds=60, id='reap_pools', replace_existing=True)
+    scheduler.start()
@@ -1,4 +1,4 @@
-from . import views
+from . import views, async_views
 from django.urls import path
 from rest_framework.routers import DefaultRouter
 
@@ -20,7 +20,19 @@ router.register('account', views.UserViewSet)
 
 urlpatterns = [
                   path('download/', views.export_excel),
+                  path('download/jobs/', views.export_job),
+                  path('download/jobs/<str:job_id>/', views.export_job_status),
+                  path('download/jobs/<str:job_id>/file/', views.export_job_file),
+                  path('upload/<path:name>/', views.upload_status),
                   path('data/', views.data_show),
+                  path('server/history/', views.server_history),
+                  path('server/db-pool/', views.db_pool_stats),
                   path('record/', views.get_record),
+                  # 高频读接口的异步版本，在ASGI下直接在事件循环中执行
+                  path('async/users/info/', async_views.get_info),
+                  path('async/publicity/activity/', async_views.get_activity),
+                  path('async/publicity/notice/', async_views.get_notice),
+                  path('async/publicity/list/', async_views.get_activity_list),
+                  path('async/messages/', async_views.get_messages),
 
               ] + router.urls
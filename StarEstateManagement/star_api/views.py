@@ -5,31 +5,45 @@ import random
 import time
 import ujson
 import xlwt
-from io import BytesIO
 
-from django.conf import settings
+from django.apps import apps
 from django_filters.views import FilterView
 from django.contrib.auth import authenticate, login, logout
 from django.db import transaction
 from django.db.models import F, Q, Count
+from django.core.signals import request_finished
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse, FileResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
 from rest_framework import status
 from rest_framework.authentication import get_authorization_header
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.response import Response
 from rest_framework.decorators import action, permission_classes
-from utils.custom_pagination import CommentsPagination
+from utils.custom_pagination import CommentsPagination, KeysetPagination
+from utils.custom_mixins import QuerysetOptimizeMixin
 from utils.custom_permission import AdminPermission, UserPermission
-from utils.aliyun_oss import bucket
+from utils.storage import upload_image, get_upload_status
+from utils.export_file import EXPORT_CONTENT_TYPES, parse_export_type, get_export_queryset, get_export_fields, \
+    iter_rows, iter_csv, build_xlsx_file
+from utils.counter import call_counter
+from utils.data_version import bump_version
+from utils.response_cache import version_cache
+from utils.metrics_store import get_history
+from star_db.backends.mysql_pool.pool import pool_stats
+from utils.evaluate_rollup import get_trend, update_rollup, invalidate_rollup
+from utils.redis_script import LOGIN_SCRIPT
+from utils.user_auth import get_token_user, get_token_owner, invalidate_token
+from utils.export_job import submit_export, get_job
 from utils.custom_search import UserFilter, ServiceFilter, ActivityApplyFilter, PublicityFilter, RepairsFilter, \
     EvaluateFilter, CommentsFilter, PaymentFilter, UserPaymentFilter, ParkingFilter, HouseFilter, MessageFilter
-from utils.send_login_code import SendSms
+from utils.sms_dispatcher import SMS_CODE_TIME, code_key, acquire_send, dispatcher
 from .serializer import *
+from .tasks import create_month_bills
 
 
-@receiver([post_save, post_delete])
 def change_cache(sender, instance, *args, **kwargs):
     """
     当模型对象执行save或delete后执行该方法
@@ -39,16 +53,85 @@ def change_cache(sender, instance, *args, **kwargs):
     :param kwargs: 关键字参数
     :return:
     """
-    cache.get_or_set('mysql', 0, 60 * 60 * 24)
-    cache.get_or_set('redis', 0, 60 * 60 * 24)
-    cache.incr('mysql')
-    cache.incr('redis')
+    # 调用次数先在进程内累加，由定时任务和请求结束时批量写入redis
+    call_counter.incr('mysql')
+    call_counter.incr('redis')
+    # 数据变更后版本号+1，使依赖该数据的缓存失效
+    bump_version(sender)
     if sender.__name__ == 'Parking' or sender.__name__ == 'House':
         cache.delete(sender.__name__.lower())
 
 
+# 只监听业务数据模型的变更
+for model in apps.get_app_config('star_db').get_models():
+    post_save.connect(change_cache, sender=model)
+    post_delete.connect(change_cache, sender=model)
+
+
+@receiver(post_save, sender=Evaluate)
+def save_evaluate_rollup(sender, instance, created, *args, **kwargs):
+    """
+    评价新增后增量更新汇总数据，修改后删除汇总数据等待重建
+    :param sender: 当前模型对象
+    :param instance: 当前实例对象
+    :param created: 是否新增
+    :return:
+    """
+    if created:
+        update_rollup(instance, 1)
+    else:
+        invalidate_rollup(instance)
+
+
+@receiver(post_delete, sender=Evaluate)
+def delete_evaluate_rollup(sender, instance, *args, **kwargs):
+    """
+    评价删除后从汇总数据中减去
+    :param sender: 当前模型对象
+    :param instance: 当前实例对象
+    :return:
+    """
+    update_rollup(instance, -1)
+
+
+@receiver(request_finished)
+def flush_counter(sender, **kwargs):
+    """
+    请求结束时将缓冲的调用次数写入redis，两次写入间隔不少于缓冲区设置的间隔
+    :param sender: 信号发送者
+    :param kwargs: 关键字参数
+    :return:
+    """
+    call_counter.flush()
+
+
+def upload_response(urls, url_field, thumb_field):
+    '''
+    生成图片上传接口的响应
+    status为done时图片地址已可访问，响应码为201
+    status为pending时图片仍在后台上传，响应码为202，调用方需要轮询status_url直到状态为done后再使用图片地址
+    status为failed时上传失败，code为1
+    :param urls: upload_image返回的图片地址和上传状态
+    :param url_field: 原尺寸图片地址的字段名
+    :param thumb_field: 缩略图地址的字段名
+    :return: 请求响应对象
+    '''
+    res = {
+        'code': 1 if urls['status'] == 'failed' else 0,
+        url_field: urls['display'],
+        thumb_field: urls['thumb'],
+        'status': urls['status'],
+        'upload_id': urls['upload_id'],
+        'status_url': f'/api/upload/{urls["upload_id"]}/'
+    }
+    if urls['status'] == 'failed':
+        return Response(res, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    return Response(res, status=status.HTTP_201_CREATED if urls['status'] == 'done' else status.HTTP_202_ACCEPTED)
+
+
 # 用户信息数据模型器类
-class UserModelViewSet(ModelViewSet):
+class UserModelViewSet(QuerysetOptimizeMixin, ModelViewSet):
+    pagination_class = KeysetPagination
     queryset = User.objects.all()
     serializer_class = UserModelSerializers
     filterset_class = UserFilter
@@ -57,6 +140,9 @@ class UserModelViewSet(ModelViewSet):
         super().create(request, *args, **kwargs)
         # 新增用户，社区总人数+1
         cache.incr('all_user')
+        # 为新用户生成本月待缴费账单
+        create_month_bills(list(self.get_queryset().filter(username=request.data.get('username')).
+                                values_list('id', flat=True)))
         return Response({'code': 0}, status=status.HTTP_201_CREATED)
 
     def update(self, request, *args, **kwargs):
@@ -96,17 +182,11 @@ class UserModelViewSet(ModelViewSet):
         :param request:请求对象
         :return: 校验结果
         '''
-        try:
-            # 根据当前用户的id获取最新用户组信息
-            group = self.get_queryset().get(id=request.user.id).group
-            # 如果是管理员则正常返回200
-            if group == 2:
-                return Response({'code': 0}, status=status.HTTP_200_OK)
-            # 如果不是管理员则返回403
-            return Response({'code': 1}, status=status.HTTP_403_FORBIDDEN)
-        # 如果用户不存在则返回401
-        except User.DoesNotExist:
-            return Response({'code': 1}, status=status.HTTP_401_UNAUTHORIZED)
+        # 用户组直接从认证时缓存的用户对象获取，不再查询数据库
+        if request.user.group == 2:
+            return Response({'code': 0}, status=status.HTTP_200_OK)
+        # 如果不是管理员则返回403
+        return Response({'code': 1}, status=status.HTTP_403_FORBIDDEN)
             
 
     @action(methods=['get'], detail=False, url_path='data', permission_classes=[AdminPermission])
@@ -179,29 +259,22 @@ class UserModelViewSet(ModelViewSet):
         res = {
             'code': 1
         }
-        # 如果文件对象存在
+        # 如果文件对象存在则交给后台线程生成缩略图并上传，上传完成前返回202，需要轮询上传状态
         if avatar:
-            # 获取文件格式
-            filetype = '.png' if avatar.content_type == 'image/png' else '.jpg'
-            # 拼接文件名
-            filename = f'{request.user.username}{avatar.name[:avatar.name.rfind(".")]}' + filetype
-            # 将文件上传oss并获取响应结果
-            res = bucket.put_object(f'media/avatar/{filename}', avatar.file)
-            # 如果响应状态码=200则上传成功更新用户头像
-            if res.status == 200:
-                res = {'code': 0, 'avatar': settings.OSS_HTTPS_URL + f'media/avatar/{filename}'}
+            return upload_response(upload_image(avatar, 'avatar'), 'avatar', 'thumb')
         return Response(res, status=status.HTTP_201_CREATED)
 
 
 # 用户服务报修数据模型器类
-class UserServiceModelViewSet(ModelViewSet, FilterView):
+class UserServiceModelViewSet(QuerysetOptimizeMixin, ModelViewSet, FilterView):
+    pagination_class = KeysetPagination
     queryset = UserService.objects.all()
     serializer_class = UserServiceSerializers
     filterset_class = ServiceFilter
 
     def get_queryset(self):
         # 只返回当前用户相关的数据
-        return UserService.objects.filter(username=self.request.user)
+        return UserService.objects.filter(username_id=self.request.user.pk)
 
     @transaction.atomic
     def destroy(self, request, *args, **kwargs):
@@ -250,7 +323,8 @@ class UserServiceModelViewSet(ModelViewSet, FilterView):
 
 
 # 活动申请数据模型器类
-class ActivityApplyModelViewSet(ModelViewSet):
+class ActivityApplyModelViewSet(QuerysetOptimizeMixin, ModelViewSet):
+    pagination_class = KeysetPagination
     queryset = ActivityApply.objects.all()
     serializer_class = ActivityApplySerializers
     filterset_class = ActivityApplyFilter
@@ -285,8 +359,11 @@ class ActivityApplyModelViewSet(ModelViewSet):
         if request.data.get('status') == 4:
             # 活动参与人数+1
             Publicity.objects.filter(id=request.data.get('publicity')).update(join=F('join') + 1)
+            # update不会触发模型信号，需要手动更新数据版本
+            bump_version(Publicity)
         # 更新用户记录的活动状态
         UserService.objects.filter(order_id=self.get_object().id).update(status=request.data.get('status'))
+        bump_version(UserService)
         return Response({'code': 0})
 
     def destroy(self, request, *args, **kwargs):
@@ -297,16 +374,12 @@ class ActivityApplyModelViewSet(ModelViewSet):
 
 
 # 社区公示数据模型器类
-class PublicityModelViewSet(ModelViewSet):
+class PublicityModelViewSet(QuerysetOptimizeMixin, ModelViewSet):
+    pagination_class = KeysetPagination
     queryset = Publicity.objects.all()
     serializer_class = PublicitySerializers
     filterset_class = PublicityFilter
 
-    def list(self, request, *args, **kwargs):
-        # 获取社区公告中结束日期小于当前日期的公告，设置为1即过期状态
-        Publicity.objects.filter(end__lt=datetime.datetime.utcnow()).update(status=1)
-        return super().list(request, *args, **kwargs)
-
     def create(self, request, *args, **kwargs):
         # 发布通知时将通知记录与用户绑定
         request.data['username'] = request.user.pk
@@ -315,7 +388,11 @@ class PublicityModelViewSet(ModelViewSet):
         # 如果type=2则说明是收费通知，此时为标题添加月份，否则不做处理
         request.data['title'] = f'{datetime.datetime.utcnow().month}月份' + title \
             if request.data.get('type') == 2 else title
-        return super().create(request, *args, **kwargs)
+        res = super().create(request, *args, **kwargs)
+        # 发布收费通知后为全部用户批量生成待缴费账单
+        if request.data.get('type') == 2:
+            create_month_bills()
+        return res
 
     def update(self, request, *args, **kwargs):
         if request.data.get('oper'):
@@ -329,6 +406,8 @@ class PublicityModelViewSet(ModelViewSet):
                 REDIS_CLIENT.setbit(f'publicity{request.data.get("id")}', request.user.pk, request.data.get('num'))
                 # 设置过期时间
                 REDIS_CLIENT.expireat(f'publicity{request.data.get("id")}', int(end_timestamp))
+                # 点赞数包含在首页数据中，点赞后使首页缓存失效
+                bump_version(Publicity)
                 return Response({'code': 0, 'good': REDIS_CLIENT.bitcount(f'publicity{request.data.get("id")}')})
             return Response({'code': 1})
         return super().update(request, *args, **kwargs)
@@ -359,6 +438,7 @@ class PublicityModelViewSet(ModelViewSet):
         return Response(data)
 
     @action(methods=['get'], detail=False, url_path='activity')
+    @version_cache('publicity_activity', Publicity)
     def get_activity(self, request):
         '''
         获取首页社区活动内容数据
@@ -373,6 +453,7 @@ class PublicityModelViewSet(ModelViewSet):
         return Response(data)
 
     @action(methods=['get'], detail=False, url_path='notice')
+    @version_cache('publicity_notice', Publicity)
     def get_notice(self, request):
         '''
         获取首页通知公告内容数据
@@ -387,6 +468,7 @@ class PublicityModelViewSet(ModelViewSet):
         return Response(data)
 
     @action(methods=['get'], detail=False, url_path='list')
+    @version_cache('publicity_list', Publicity)
     def get_activity_list(self, request):
         '''
         获取可报名活动列表
@@ -424,26 +506,18 @@ class PublicityModelViewSet(ModelViewSet):
         """
         # 获取文件对象
         image = request.FILES.get('image')
-        # 获取数据库最后一个id
-        queryset = self.get_queryset().order_by('-id')
-        id = queryset[0].id if queryset else 0
         res = {
             'code': 1
         }
-        # 如果文件对象存在
+        # 如果文件对象存在则交给后台线程生成缩略图并上传，上传完成前返回202，需要轮询上传状态
         if image:
-            # 获取文件格式
-            filetype = '.png' if image.content_type == 'image/png' else '.jpg'
-            # 将文件上传oss并获取响应结果
-            res = bucket.put_object(f'media/image/{id + 1}' + filetype, image.file)
-            # 如果响应状态码=200则上传成功更新活动图片
-            if res.status == 200:
-                res = {'code': 0, 'img_url': settings.OSS_HTTPS_URL + f'media/image/{id + 1}' + filetype}
+            return upload_response(upload_image(image, 'image'), 'img_url', 'thumb_url')
         return Response(res, status=status.HTTP_201_CREATED)
 
 
 # 报修申请数据模型器类
-class RepairsApplyModelViewSet(ModelViewSet):
+class RepairsApplyModelViewSet(QuerysetOptimizeMixin, ModelViewSet):
+    pagination_class = KeysetPagination
     queryset = RepairsApply.objects.all()
     serializer_class = RepairsApplySerializers
     filterset_class = RepairsFilter
@@ -468,7 +542,8 @@ class RepairsApplyModelViewSet(ModelViewSet):
 
 
 # 评价反馈数据模型器类
-class EvaluateModelViewSet(ModelViewSet):
+class EvaluateModelViewSet(QuerysetOptimizeMixin, ModelViewSet):
+    pagination_class = KeysetPagination
     queryset = Evaluate.objects.all()
     serializer_class = EvaluateSerializers
     filterset_class = EvaluateFilter
@@ -483,6 +558,8 @@ class EvaluateModelViewSet(ModelViewSet):
         if request.data.get('score'):
             # 根据传入的记录id把对应任务状态改为7表示已评价，分数改为传入的分数
             obj.objects.filter(id=request.data.get('record_id')).update(status=7, score=request.data.get('score'))
+            # update不会触发模型信号，需要手动更新数据版本
+            bump_version(obj)
         else:
             order_type = request.data.get('order_type')
             # 如果是反馈则获取反馈任务对象
@@ -495,6 +572,7 @@ class EvaluateModelViewSet(ModelViewSet):
                 queryset = queryset.filter(~Q(type='A'))
             # 修改任务状态为6表示反馈中
             queryset.update(status=6)
+            bump_version(obj)
             # 将反馈任务名记录
             request.data['name'] = queryset.first().name
         return super().create(request, *args, **kwargs)
@@ -502,44 +580,23 @@ class EvaluateModelViewSet(ModelViewSet):
     @action(methods=['get'], detail=False, url_path='data', permission_classes=[AdminPermission])
     def get_data(self, request):
         '''
-        获取今日各类评价数据
+        获取各类评价数据，range为week时按星期数返回最近7天，month返回最近30天，year返回最近12个月
         :param request: 请求对象
-        :return: 包含今日评价信息的JSON数据响应对象
+        :return: 包含评价信息的JSON数据响应对象
         '''
-        # 初始化评价数据
-        evaluate_list = {
-            'praise': [0, 0, 0, 0, 0, 0, 0],
-            'general': [0, 0, 0, 0, 0, 0, 0],
-            'negative': [0, 0, 0, 0, 0, 0, 0]
-        }
+        # 从按天和按月预先汇总的数据中读取，不再遍历评价记录
+        evaluate_list, labels = get_trend(request.query_params.get('range', 'week'))
         data = {
             'code': 0,
             'list': evaluate_list
         }
-        # 获取7天内的评价数据的星期数和分数
-        evaluates = self.get_queryset().filter(create_time__gte=datetime.datetime.utcnow() - datetime.timedelta(weeks=1)
-                                               , type=0).values_list('weekday', 'score')
-        # 遍历评价数据按分数和星期数计数
-        for item in list(evaluates):
-            # 如果星期数为7则改为0
-            weekday = item[0] if item[0] < 7 else 0
-            # 分数小于3则说明是差评
-            if item[1] < 3:
-                # 修改评价等级数据对应星期的评价量
-                evaluate_list['negative'][weekday] += 1
-            # 分数大于等于3小于5说明是一般
-            elif 3 <= item[1] < 5:
-                # 修改评价等级数据对应星期的评价量
-                evaluate_list['general'][weekday] += 1
-            # 分数等于5说明是好评
-            else:
-                # 修改评价等级数据对应星期的评价量
-                evaluate_list['praise'][weekday] += 1
+        if labels:
+            data['labels'] = labels
         return Response(data)
 
 
 # 评论留言模型器类
-class CommentsModelViewSet(ModelViewSet):
+class CommentsModelViewSet(QuerysetOptimizeMixin, ModelViewSet):
     pagination_class = CommentsPagination
     queryset = Comments.objects.all()
     serializer_class = CommentsSerializers
@@ -572,41 +629,61 @@ class CommentsModelViewSet(ModelViewSet):
     def update(self, request, *args, **kwargs):
         super().update(request, *args, **kwargs)
         # 查找与它相关联的评论数据并一起屏蔽
-        self.get_all_comments([request.data.get('id')], 'shield')
+        instance = self.get_object()
+        if instance.path:
+            # 通过路径前缀一次性屏蔽全部子评论
+            instance.get_thread().exclude(id=instance.id).update(show=0, status=0)
+            # update不会触发模型信号，需要手动更新数据版本
+            bump_version(Comments)
+        else:
+            self.get_all_comments([instance.id], 'shield')
         return Response({'code': 0})
 
     def destroy(self, request, *args, **kwargs):
-        super().destroy(request, *args, **kwargs)
-        # 查找与它相关联的评论数据并一起删除
-        self.get_all_comments([request.query_params.get('id')], 'delete')
+        instance = self.get_object()
+        if instance.path:
+            # 通过路径前缀一次性删除评论及其全部子评论
+            instance.get_thread().delete()
+        else:
+            super().destroy(request, *args, **kwargs)
+            # 查找与它相关联的评论数据并一起删除
+            self.get_all_comments([instance.id], 'delete')
         return Response({'code': 0})
 
+    @action(methods=['get'], detail=True, url_path='thread')
+    def get_thread(self, request, pk=None):
+        '''
+        获取指定评论及其全部子评论
+        :param request: 请求对象
+        :param pk: 评论id
+        :return: 包含评论楼层数据的JSON数据响应对象
+        '''
+        instance = self.get_object()
+        queryset = instance.get_thread() if instance.path else self.get_queryset().filter(id=instance.id)
+        data = {
+            'code': 0,
+            'list': self.get_serializer(queryset.order_by('create_time'), many=True).data
+        }
+        return Response(data)
+
     def get_all_comments(self, f_id_list, oper):
         '''
-        递归找出指定评论相关的子评论
+        逐层找出未生成路径的历史评论的子评论
         :param f_id_list: 父评论id列表
         :param oper: 要进行的操作
         :return: None 跳出递归
         '''
-        # 下一批父id的列表
-        id_list = []
         if f_id_list:
             # 获取父id在目标id里的评论对象
             queryset = self.get_queryset().filter(father_id__in=f_id_list)
-            for instance in queryset:
-                # 将删除的元素id加入作为新的父id列表再查找
-                id_list.append(instance.id)
-                # 如果是屏蔽操作
-                if oper == 'shield':
-                    # show设置为不可展示
-                    instance.show = 0
-                    # 状态设为0表示已屏蔽
-                    instance.status = 0
-                    # 保存修改
-                    instance.save()
-                else:
-                    # 如果是删除操作则删除对象
-                    instance.delete()
+            # 将这一层的评论id作为新的父id列表再查找
+            id_list = list(queryset.values_list('id', flat=True))
+            # 如果是屏蔽操作则整层屏蔽，否则整层删除
+            if oper == 'shield':
+                queryset.update(show=0, status=0)
+                bump_version(Comments)
+            else:
+                queryset.delete()
             # 递归查找相关的评论
             self.get_all_comments(id_list, oper)
         else:
@@ -614,7 +691,8 @@ class CommentsModelViewSet(ModelViewSet):
 
 
 # 资金收缴数据模型器类
-class PaymentModelViewSet(ModelViewSet):
+class PaymentModelViewSet(QuerysetOptimizeMixin, ModelViewSet):
+    pagination_class = KeysetPagination
     queryset = Payment.objects.all()
     serializer_class = PaymentSerializers
     filterset_class = PaymentFilter
@@ -644,6 +722,7 @@ class PaymentModelViewSet(ModelViewSet):
         else:
             # 如果是社区缴费只要更新缴费状态即可
             Publicity.objects.filter(title=res.data.get('name')).update(join=F('join') + 1)
+            bump_version(Publicity)
             # 将对应的用户缴费记录设置为3表示已缴费并写入订单号
             UserPayment.objects.filter(username_id=request.user.pk, name=res.data.get('name')). \
                 update(status=3, order_id=res.data.get('id'))
@@ -667,32 +746,15 @@ class PaymentModelViewSet(ModelViewSet):
 
 
 # 用户缴费情况数据模型器类
-class UserPaymentsModelViewSet(ModelViewSet):
+class UserPaymentsModelViewSet(QuerysetOptimizeMixin, ModelViewSet):
+    pagination_class = KeysetPagination
     queryset = UserPayment.objects.all()
     serializer_class = UserPaymentSerializers
     filterset_class = UserPaymentFilter
 
     def get_queryset(self):
         # 只返回当前用户相关的数据
-        return UserPayment.objects.filter(username=self.request.user)
-
-    def list(self, request, *args, **kwargs):
-        # 获取本月收费款项的id列表
-        month_payment = Publicity.objects.filter(create_time__month=datetime.datetime.utcnow().month, type=2)
-        payment_dict = {'水费': 0, '电费': 1, '物业费': 2, '燃气费': 3}
-        for task in month_payment:
-            # 获取后台缴费记录
-            payment = Payment.objects.filter(name=task.title, username_id=request.user.id)
-            # 获取前台待缴费款项
-            user_payment = UserPayment.objects.filter(username_id=request.user.id, name=task.title)
-            # 如果后台不存在缴费记录且用户前台没有待缴费款项则创建一条待缴费记录
-            if not payment and not user_payment:
-                # 获取缴费类型
-                money_type = payment_dict.get(task.title[task.title.find('份') + 1:])
-                # 创建待缴费款项
-                UserPayment.objects.create(username_id=request.user.id, money=task.money, name=task.title,
-                                           type=money_type)
-        return super().list(request, *args, **kwargs)
+        return UserPayment.objects.filter(username_id=self.request.user.pk)
 
     @transaction.atomic
     def destroy(self, request, *args, **kwargs):
@@ -719,7 +781,8 @@ class UserPaymentsModelViewSet(ModelViewSet):
 
 
 # 车位使用数据模型器类
-class ParkingModelViewSet(ModelViewSet):
+class ParkingModelViewSet(QuerysetOptimizeMixin, ModelViewSet):
+    pagination_class = KeysetPagination
     queryset = Parking.objects.all()
     serializer_class = ParkingSerializers
     filterset_class = ParkingFilter
@@ -765,7 +828,8 @@ class ParkingModelViewSet(ModelViewSet):
 
 
 # 获取房屋使用数据模型器类
-class HouseModelViewSet(ModelViewSet):
+class HouseModelViewSet(QuerysetOptimizeMixin, ModelViewSet):
+    pagination_class = KeysetPagination
     queryset = House.objects.all()
     serializer_class = HouseSerializers
     filterset_class = HouseFilter
@@ -825,29 +889,10 @@ def login_success(request, user, login_type):
     status_code = status.HTTP_200_OK
     # 获取请求认证头
     key = get_authorization_header(request).split()
+    old_token = key[1].decode() if len(key) > 1 else ''
+    new_token = binascii.hexlify(os.urandom(20)).decode()
     # 获取当前用户的username和name组成key并序列化
     user_key = ujson.dumps({'username': request.user.username, 'name': request.user.name}, ensure_ascii=False)
-    # 如果login_ranking不存在则进行初始化
-    if not REDIS_CLIENT.exists('login_ranking'):
-        REDIS_CLIENT.zadd('login_ranking', {0: 0})
-        REDIS_CLIENT.expireat('login_ranking', 60 * 60 * 24)
-    # 如果user不存在于有序集合中则将它加入有序集合并设置分数为1表示登录了一次
-    if REDIS_CLIENT.zscore('login_ranking', user_key) is None:
-        REDIS_CLIENT.zadd('login_ranking', {user_key: 1})
-        # 如果有序集合数大于10则删除分数低于第10名全部元素
-        if REDIS_CLIENT.zcard('login_ranking') > 10:
-            # 删除前面0到-11的元素，有序集合默认按分数低到高排序，-1分数最高
-            REDIS_CLIENT.zremrangbyrank('login_ranking', 0, -11)
-    else:
-        # 如果已存在则将分数+1
-        REDIS_CLIENT.zincrby('login_ranking', 1, user_key)
-    # 登录方式+1
-    if not cache.get(login_type, 0):
-        cache.set(login_type, 0, 60*60*24)
-    cache.incr(login_type)
-    # 如果token还在有效期则不生成新token
-    token = key[1] if key and cache.ttl(key) > 0 else binascii.hexlify(os.urandom(20)).decode()
-    data['token'] = token
     # 封装用户信息
     user_info = {
         'id': request.user.pk,
@@ -856,8 +901,21 @@ def login_success(request, user, login_type):
         'group': request.user.group,
         'avatar': request.user.avatar
     }
-    # 将用户信息序列化后存入redis中有效期7天
-    cache.set_many({token: ujson.dumps(user_info)}, 60 * 60 * 24 * 7)
+    # 请求头中的旧token只有保存的是当前用户的信息时才沿用，避免覆盖其他缓存数据或接管其他用户的token
+    owner, old_data = get_token_owner(old_token) if old_token else (None, None)
+    if owner != request.user.pk:
+        old_token, old_data = '', ''
+    # 一次脚本调用完成登录排行、登录方式计数和token写入，token还在有效期则不生成新token，新token有效期7天
+    reuse = LOGIN_SCRIPT(
+        keys=['login_ranking', cache.make_key(login_type), cache.make_key(old_token) if old_token else '',
+              cache.make_key(new_token)],
+        args=[user_key, 60 * 60 * 24, 60 * 60 * 24 * 7, cache._cache._serializer.dumps(ujson.dumps(user_info)),
+              old_data]
+    )
+    data['token'] = old_token if reuse else new_token
+    # 沿用旧token时用户信息已重新写入，通知所有进程删除旧的缓存
+    if reuse:
+        invalidate_token(old_token)
     return data, status_code
 
 
@@ -926,14 +984,19 @@ class UserViewSet(ModelViewSet):
         :param request:请求对象
         :return: 包含发送成功提示信息的JSON数据响应对象
         '''
+        phone = request.data.get('phone')
+        if not phone:
+            return Response({'code': 1}, status=status.HTTP_400_BAD_REQUEST)
+        # 每个手机号按令牌桶限制发送频率
+        allowed, wait = acquire_send(phone)
+        if not allowed:
+            return Response({'code': 1, 'wait': wait}, status=status.HTTP_429_TOO_MANY_REQUESTS)
         # 随机生成登录验证码
-        login_code = random.randint(100000, 999999)
-        # 获取短信对象
-        sms = SendSms()
-        # 根据用户号码发送短信
-        sms.main(request.data.get('phone'), str(login_code))
-        # redis保存短信验证码60s
-        cache.set('code', str(login_code), 60)
+        login_code = str(random.randint(100000, 999999))
+        # redis按手机号保存短信验证码60s
+        cache.set(code_key(phone), login_code, SMS_CODE_TIME)
+        # 提交到短信发送队列后立即返回
+        dispatcher.send(phone, login_code)
         return Response({'code': 0})
 
     @action(methods=['post'], detail=False, url_path='login')
@@ -955,7 +1018,9 @@ class UserViewSet(ModelViewSet):
                 # 获取手机号用户对象
                 user = self.get_queryset().get(phone=phone)
                 # 如果验证码正确则执行用户登录
-                if cache.get('code') == code:
+                if code and cache.get(code_key(phone)) == str(code):
+                    # 验证码只能使用一次
+                    cache.delete(code_key(phone))
                     # 执行用户登录
                     data, status_code = login_success(request, user, 'phone')
                 else:
@@ -991,8 +1056,9 @@ class UserViewSet(ModelViewSet):
         logout(request)
         # 获取token
         token = request.META.get('HTTP_AUTHORIZATION').split()[1]
-        # 从redis中删除用户token
+        # 从redis中删除用户token并通知所有进程删除缓存
         cache.delete(token)
+        invalidate_token(token)
         return Response({'code': 0}, status=status.HTTP_204_NO_CONTENT)
 
     @action(methods=['post'], detail=False, url_path='register')
@@ -1011,12 +1077,15 @@ class UserViewSet(ModelViewSet):
             # 社区总用户+1
             cache.get_or_set('all_user', 0, 60 * 60 * 24)
             cache.incr('all_user')
+            # 为新用户生成本月待缴费账单
+            create_month_bills(list(self.get_queryset().filter(username=request.data.get('username')).
+                                    values_list('id', flat=True)))
             return Response({'code': 0}, status=status.HTTP_201_CREATED)
         return Response({'code': 1}, status=status.HTTP_204_NO_CONTENT)
 
 
 # 消息通知数据模型器类
-class MessageModelViewSet(ModelViewSet):
+class MessageModelViewSet(QuerysetOptimizeMixin, ModelViewSet):
     pagination_class = CommentsPagination
     queryset = Message.objects.all()
     serializer_class = MessageSerializers
@@ -1028,23 +1097,34 @@ class MessageModelViewSet(ModelViewSet):
             # 将反馈任务状态从未处理调整为已处理
             instance = Evaluate.objects.filter(id=request.data.pop('id'))
             instance.update(status=1)
+            # update不会触发模型信号，需要手动更新数据版本和评价汇总
+            bump_version(Evaluate)
+            if instance.first() is not None:
+                invalidate_rollup(instance.first())
             # 获取用户服务对象和用户缴费对象
             try:
                 UserService.objects.filter(order_id=instance.first().record_id, name=instance.first().name).update(
                     status=3)
+                bump_version(UserService)
             except:
                 UserPayment.objects.filter(order_id=instance.first().record_id, name=instance.first().name).update(
                     status=3)
+                bump_version(UserPayment)
         # 将信息与当前用户绑定
         request.data['username'] = request.user.pk
         return super().create(request, *args, **kwargs)
 
     def list(self, request, *args, **kwargs):
         # 返回接收人id等于当前用户的信息
+        queryset = self.get_queryset().filter(recipient_id=request.user.username)
+        fields = ('id', 'recipient_name', 'create_time', 'content')
+        # 传入游标时按游标分页返回
+        if self.paginator.cursor_query_param in request.query_params:
+            page = self.paginate_queryset(queryset)
+            return self.get_paginated_response(self.get_serializer(page, many=True, fields=fields).data)
         return Response({
             'code': 0,
-            'list': self.get_serializer(self.get_queryset().filter(recipient_id=request.user.username), many=True,
-                                        fields=('id', 'recipient_name', 'create_time', 'content')).data
+            'list': self.get_serializer(queryset, many=True, fields=fields).data
         })
 
 
@@ -1056,47 +1136,171 @@ def export_excel(request):
     '''
     row = 1
     # 获取需要的数据类型
-    data_type = int(request.GET.get('type'))
+    data_type = parse_export_type(request.GET.get('type'))
+    if data_type is None:
+        return JsonResponse({'code': 1}, status=status.HTTP_400_BAD_REQUEST)
+    # 获取导出格式，csv和xlsx以流式响应返回，默认导出xls
+    file_format = request.GET.get('format', 'xls')
     # 获取token
-    token = request.META.get('HTTP_AUTHORIZATION').split()[1]
-    user_id = ujson.loads(cache.get(token)).get('id')
+    user_id = get_request_user_id(request)
+    # 获取需要的数据对象
+    obj, queryset = get_export_queryset(data_type, user_id)
+    # 获取所有字段名列表
+    fields = get_export_fields(obj)
+    if file_format in EXPORT_CONTENT_TYPES:
+        # csv边读边写，xlsx先写入临时文件再分块读取，内存占用不随数据量增长
+        if file_format == 'csv':
+            res = StreamingHttpResponse(iter_csv(queryset, fields), content_type=EXPORT_CONTENT_TYPES[file_format])
+        else:
+            res = FileResponse(build_xlsx_file(queryset, fields), content_type=EXPORT_CONTENT_TYPES[file_format])
+        res.setdefault("Access-Control-Expose-Headers", "Content-Disposition")
+        res["Content-Disposition"] = f'attachment;filename={obj.__name__}.{file_format}'
+        return res
     # 设定编码类型为UTF-8
     wb = xlwt.Workbook(encoding='utf-8')
     # excel添加类别
     sheet = wb.add_sheet(u'表格')
-    # 获取需要的数据对象
-    obj_list = [UserService, UserPayment, User, Publicity, RepairsApply, Evaluate, Comments]
-    obj = obj_list[data_type]
     # 配置响应头
     res = HttpResponse(content_type="application/vnd.ms-excel")
     res.setdefault("Access-Control-Expose-Headers", "Content-Disposition")
     res["Content-Disposition"] = f'attachment;filename={obj.__name__}.xls'
-    # 获取数据值列表
-    data_list = obj.objects.filter(username__id=user_id).values() if data_type < 2 else obj.objects.values()
-    # 获取所有字段名列表
-    fields = [field for field in data_list[0].keys()]
     # 将字段名写入文档第一行
     for i in range(len(fields)):
         sheet.write(0, i, fields[i])
     # 将数据按行写入文档
-    for items in data_list:
-        row_data = list(items.values())
+    for row_data in iter_rows(queryset, fields):
         for i in range(len(row_data)):
             sheet.write(row, i, row_data[i])
         row = row + 1
-    # 创建字节流对象
-    output = BytesIO()
-    # 将字节流对象保存
-    wb.save(output)
-    # 移动偏移指针
-    output.seek(0)
-    # 将字节流数据写入响应对象
-    res.write(output.getvalue())
-    # 关闭字节流对象
-    output.close()
+    # 将文档直接写入响应对象
+    wb.save(res)
     return res
 
 
+def get_request_user_id(request):
+    '''
+    根据请求头中的token获取当前用户id
+    :param request: 请求对象
+    :return: 用户id，token无效时为None
+    '''
+    user = get_request_user(request)
+    return user.pk if user else None
+
+
+def get_request_user(request):
+    '''
+    根据请求头中的token获取当前用户
+    :param request: 请求对象
+    :return: 用户对象，token无效时为None
+    '''
+    key = request.META.get('HTTP_AUTHORIZATION', '').split()
+    return get_token_user(key[1]) if len(key) == 2 else None
+
+
+@csrf_exempt
+@require_POST
+def export_job(request):
+    '''
+    提交后台导出任务
+    :param request: 请求对象
+    :return: 包含任务id的JSON数据响应对象
+    '''
+    user_id = get_request_user_id(request)
+    if user_id is None:
+        return JsonResponse({'code': 1}, status=status.HTTP_401_UNAUTHORIZED)
+    # 获取需要的数据类型和导出格式
+    data_type = parse_export_type(request.POST.get('type', request.GET.get('type')))
+    file_format = request.POST.get('format', request.GET.get('format', 'xlsx'))
+    if data_type is None or file_format not in EXPORT_CONTENT_TYPES:
+        return JsonResponse({'code': 1}, status=status.HTTP_400_BAD_REQUEST)
+    return JsonResponse({'code': 0, 'job_id': submit_export(data_type, user_id, file_format)},
+                        status=status.HTTP_202_ACCEPTED)
+
+
+@require_GET
+def export_job_status(request, job_id):
+    '''
+    获取导出任务进度
+    :param request: 请求对象
+    :param job_id: 任务id
+    :return: 包含任务状态和进度的JSON数据响应对象
+    '''
+    job = get_job(job_id)
+    # 只允许查看自己提交的任务
+    if not job or job.get('user_id') != str(get_request_user_id(request)):
+        return JsonResponse({'code': 1}, status=status.HTTP_404_NOT_FOUND)
+    return JsonResponse({'code': 0, 'status': job.get('status'), 'progress': int(job.get('progress', 0))})
+
+
+@require_GET
+def export_job_file(request, job_id):
+    '''
+    下载已完成的导出文件
+    :param request: 请求对象
+    :param job_id: 任务id
+    :return: 导出文件数据流对象
+    '''
+    job = get_job(job_id)
+    if not job or job.get('user_id') != str(get_request_user_id(request)):
+        return JsonResponse({'code': 1}, status=status.HTTP_404_NOT_FOUND)
+    # 任务未完成或文件已被清理
+    if job.get('status') != 'done' or not os.path.exists(job.get('path')):
+        return JsonResponse({'code': 1, 'status': job.get('status')}, status=status.HTTP_409_CONFLICT)
+    res = FileResponse(open(job.get('path'), 'rb'), content_type=EXPORT_CONTENT_TYPES[job.get('format')])
+    res.setdefault("Access-Control-Expose-Headers", "Content-Disposition")
+    res["Content-Disposition"] = f'attachment;filename={job.get("filename")}'
+    return res
+
+
+@require_GET
+def upload_status(request, name):
+    '''
+    获取图片上传状态，上传接口返回pending时轮询该接口，状态为done后图片地址可以访问
+    :param request: 请求对象
+    :param name: 上传接口返回的upload_id
+    :return: 包含上传状态的JSON数据响应对象
+    '''
+    if get_request_user_id(request) is None:
+        return JsonResponse({'code': 1}, status=status.HTTP_401_UNAUTHORIZED)
+    upload = get_upload_status(name)
+    # 没有上传记录或记录已过期
+    if upload is None:
+        return JsonResponse({'code': 1}, status=status.HTTP_404_NOT_FOUND)
+    return JsonResponse({'code': 1 if upload == 'failed' else 0, 'status': upload})
+
+
+@require_GET
+def server_history(request):
+    '''
+    获取服务器cpu和内存使用率历史数据，range为hour、day、week或month
+    :param request: 请求对象
+    :return: 包含历史数据的JSON数据响应对象
+    '''
+    user = get_request_user(request)
+    if user is None:
+        return JsonResponse({'code': 1}, status=status.HTTP_401_UNAUTHORIZED)
+    # 只允许管理员查看
+    if user.group != 2:
+        return JsonResponse({'code': 1}, status=status.HTTP_403_FORBIDDEN)
+    return JsonResponse({'code': 0, 'list': get_history(request.GET.get('range', 'hour'))})
+
+
+@require_GET
+def db_pool_stats(request):
+    '''
+    获取当前进程数据库连接池的状态
+    :param request: 请求对象
+    :return: 包含连接池指标的JSON数据响应对象
+    '''
+    user = get_request_user(request)
+    if user is None:
+        return JsonResponse({'code': 1}, status=status.HTTP_401_UNAUTHORIZED)
+    # 只允许管理员查看
+    if user.group != 2:
+        return JsonResponse({'code': 1}, status=status.HTTP_403_FORBIDDEN)
+    return JsonResponse({'code': 0, 'pid': os.getpid(), 'data': pool_stats()})
+
+
 def data_show(request):
     '''
     用于获取系统监控数据
@@ -1128,11 +1332,14 @@ def data_show(request):
             }
         # 获取redis调用数据
         case '1':
-            cache.incr('redis')
+            call_counter.incr('redis')
+            # 读取前先写入本进程缓冲的计数
+            call_counter.flush(force=True)
             data = {'code': 0, 'total': cache.get('redis')}
         # 获取mysql调用数据
         case '2':
-            cache.incr('mysql')
+            call_counter.incr('mysql')
+            call_counter.flush(force=True)
             data = {'code': 0, 'total': cache.get('mysql')}
     return JsonResponse(data)
 
@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class StarFrontConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'star_db'
+
+    def ready(self):
+        from star_db.fulltext import create_fulltext_indexes
+        # 迁移完成后创建全文索引
+        post_migrate.connect(create_fulltext_indexes, sender=self)
@@ -0,0 +1,43 @@
+from django.db.backends.mysql import base as mysql_base
+
+from .pool import ConnectionPool, PoolTimeout, get_pool
+
+
+class DatabaseWrapper(mysql_base.DatabaseWrapper):
+    """
+    使用连接池的mysql数据库后端
+    关闭连接时将连接归还连接池而不是断开，请求中获取连接不再需要建立tcp连接和认证
+    配置CONN_MAX_AGE=0时每个请求结束后归还连接，后台线程的连接也由close_old_connections归还
+    """
+
+    def get_new_connection(self, conn_params):
+        '''
+        从连接池中获取连接，没有可用连接时创建新连接
+        :param conn_params: 连接参数
+        :return: 数据库连接
+        '''
+        try:
+            return get_pool(self.alias).acquire(lambda: super(DatabaseWrapper, self).get_new_connection(conn_params))
+        except PoolTimeout as e:
+            raise mysql_base.Database.OperationalError(str(e))
+
+    def init_connection_state(self):
+        '''
+        初始化会话参数，复用的连接已初始化过，不再重复执行
+        :return:
+        '''
+        if getattr(self.connection, 'pool_initialized', False):
+            return
+        super().init_connection_state()
+        self.connection.pool_initialized = True
+
+    def _close(self):
+        '''
+        将连接归还连接池，事务中关闭、自动提交状态被修改或出错后不可用的连接直接断开
+        :return:
+        '''
+        if self.connection is None:
+            return
+        discard = self.in_atomic_block or self.autocommit != self.settings_dict['AUTOCOMMIT'] or \
+            (self.errors_occurred and not ConnectionPool.ping(self.connection))
+        get_pool(self.alias).release(self.connection, discard)
@@ -0,0 +1,240 @@
+import os
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+# 每个数据库的最大连接数
+DB_POOL_SIZE = getattr(settings, 'DB_POOL_SIZE', 10)
+# 连接全部被占用时等待空闲连接的最长时间(秒)
+DB_POOL_TIMEOUT = getattr(settings, 'DB_POOL_TIMEOUT', 10)
+# 连接空闲超过该时间(秒)后，取出时先ping检查是否可用
+DB_POOL_PING_INTERVAL = getattr(settings, 'DB_POOL_PING_INTERVAL', 10)
+# 连接空闲超过该时间(秒)后被回收，需小于mysql的wait_timeout
+DB_POOL_IDLE_TIMEOUT = getattr(settings, 'DB_POOL_IDLE_TIMEOUT', 300)
+# 连接创建超过该时间(秒)后不再复用
+DB_POOL_RECYCLE = getattr(settings, 'DB_POOL_RECYCLE', 3600)
+
+
+class PoolTimeout(Exception):
+    """
+    等待空闲连接超时
+    """
+
+
+class ConnectionPool(object):
+    """
+    数据库连接池，每个进程每个数据库一个，线程安全
+    取出连接时优先使用最近归还的连接，长时间空闲的连接留在队列头部等待回收
+    """
+
+    def __init__(self, max_size, timeout, ping_interval, idle_timeout, recycle):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        self.idle_timeout = idle_timeout
+        self.recycle = recycle
+        # 空闲连接队列，元素为(连接, 创建时间, 归还时间)
+        self._idle = deque()
+        # 已创建的连接数，包括空闲和正在使用的连接
+        self._size = 0
+        # 正在使用的连接的创建时间
+        self._created = {}
+        self._cond = threading.Condition()
+        self._pid = os.getpid()
+        self._counters = dict.fromkeys(
+            ('created', 'reused', 'closed', 'ping_failed', 'waits', 'timeouts', 'wait_ms'), 0
+        )
+
+    def _check_fork(self):
+        '''
+        子进程不能使用父进程创建的连接，丢弃继承的连接但不关闭，避免影响父进程
+        :return:
+        '''
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._idle.clear()
+            self._created.clear()
+            self._size = 0
+
+    def _close(self, connection):
+        '''
+        关闭连接，连接已断开时忽略异常
+        :param connection: 数据库连接
+        :return:
+        '''
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _discard(self, connection):
+        '''
+        关闭并移除连接，唤醒一个等待的线程创建新连接
+        :param connection: 数据库连接
+        :return:
+        '''
+        self._close(connection)
+        with self._cond:
+            self._size -= 1
+            self._created.pop(id(connection), None)
+            self._counters['closed'] += 1
+            self._cond.notify()
+
+    @staticmethod
+    def ping(connection):
+        '''
+        检查连接是否可用，不自动重连，避免丢失会话状态
+        :param connection: 数据库连接
+        :return: 是否可用
+        '''
+        try:
+            connection.ping(False)
+        except Exception:
+            return False
+        return True
+
+    def acquire(self, connect):
+        '''
+        取出一个可用连接，没有空闲连接且未达到最大连接数时创建新连接，否则等待其他线程归还
+        :param connect: 创建新连接的函数
+        :return: 数据库连接
+        '''
+        deadline = time.monotonic() + self.timeout
+        waited = False
+        while True:
+            with self._cond:
+                self._check_fork()
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._counters['timeouts'] += 1
+                        raise PoolTimeout(f'no free connection in {self.timeout}s, pool size {self.max_size}')
+                    if not waited:
+                        waited = True
+                        self._counters['waits'] += 1
+                    start = time.monotonic()
+                    self._cond.wait(remaining)
+                    self._counters['wait_ms'] += int((time.monotonic() - start) * 1000)
+                if self._idle:
+                    connection, created, released = self._idle.pop()
+                    self._created[id(connection)] = created
+                else:
+                    # 先占用名额，在锁外创建连接
+                    connection = None
+                    self._size += 1
+            if connection is None:
+                try:
+                    connection = connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._created[id(connection)] = time.monotonic()
+                    self._counters['created'] += 1
+                return connection
+            now = time.monotonic()
+            # 超过最长使用时间或空闲较久且ping失败的连接直接丢弃，重新获取
+            if now - created > self.recycle:
+                self._discard(connection)
+                continue
+            if now - released > self.ping_interval and not self.ping(connection):
+                with self._cond:
+                    self._counters['ping_failed'] += 1
+                self._discard(connection)
+                continue
+            with self._cond:
+                self._counters['reused'] += 1
+            return connection
+
+    def release(self, connection, discard=False):
+        '''
+        归还连接，不可用或超过最长使用时间的连接直接关闭
+        :param connection: 数据库连接
+        :param discard: 是否关闭连接
+        :return:
+        '''
+        with self._cond:
+            self._check_fork()
+            created = self._created.get(id(connection))
+            if created is not None and not discard and time.monotonic() - created <= self.recycle:
+                del self._created[id(connection)]
+                self._idle.append((connection, created, time.monotonic()))
+                self._cond.notify()
+                return
+        # 不属于当前进程连接池的连接(如fork前创建)只关闭，不计入连接数
+        if created is None:
+            self._close(connection)
+        else:
+            self._discard(connection)
+
+    def reap(self):
+        '''
+        关闭空闲超时的连接
+        :return: 关闭的连接数
+        '''
+        expired = []
+        now = time.monotonic()
+        with self._cond:
+            self._check_fork()
+            # 队列头部是最久未使用的连接
+            while self._idle and (now - self._idle[0][2] > self.idle_timeout or
+                                  now - self._idle[0][1] > self.recycle):
+                expired.append(self._idle.popleft()[0])
+            self._size -= len(expired)
+            self._counters['closed'] += len(expired)
+            if expired:
+                self._cond.notify(len(expired))
+        for connection in expired:
+            self._close(connection)
+        return len(expired)
+
+    def stats(self):
+        '''
+        获取连接池状态
+        :return: 连接池指标
+        '''
+        with self._cond:
+            self._check_fork()
+            return dict(self._counters, size=self._size, idle=len(self._idle), in_use=self._size - len(self._idle),
+                        max_size=self.max_size)
+
+
+# 各数据库的连接池，键为数据库别名
+pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias):
+    '''
+    获取数据库的连接池，每个进程每个数据库只创建一次
+    :param alias: 数据库别名
+    :return: 连接池对象
+    '''
+    pool = pools.get(alias)
+    if pool is None:
+        with _pools_lock:
+            pool = pools.get(alias)
+            if pool is None:
+                pool = pools[alias] = ConnectionPool(DB_POOL_SIZE, DB_POOL_TIMEOUT, DB_POOL_PING_INTERVAL,
+                                                     DB_POOL_IDLE_TIMEOUT, DB_POOL_RECYCLE)
+    return pool
+
+
+def reap_pools():
+    '''
+    回收所有连接池中空闲超时的连接
+    :return: 关闭的连接数
+    '''
+    return sum(pool.reap() for pool in list(pools.values()))
+
+
+def pool_stats():
+    '''
+    获取当前进程所有连接池的状态
+    :return: 键为数据库别名的连接池指标
+    '''
+    return {alias: pool.stats() for alias, pool in list(pools.items())}
@@ -0,0 +1,104 @@
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.models import FloatField, Func, Q
+
+from star_db.models import Comments, Publicity, RepairsApply, UserService
+
+# 需要全文检索的数据模型及字段，MATCH的字段必须与索引字段完全一致
+FULLTEXT_INDEXES = {
+    Comments: ('comment',),
+    Publicity: ('title', 'content'),
+    RepairsApply: ('name',),
+    UserService: ('name',),
+}
+# ngram分词长度，与mysql的ngram_token_size默认值一致，短于该长度的关键词无法通过索引匹配
+NGRAM_TOKEN_SIZE = 2
+# 已检查过的全文索引是否存在，键为(数据库别名, 表名)
+_index_exists = {}
+
+
+class Match(Func):
+    """
+    mysql全文检索表达式，返回匹配相关度
+    """
+    output_field = FloatField()
+
+    def __init__(self, *expressions, query):
+        self.query = query
+        super().__init__(*expressions)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        columns = [compiler.compile(expression)[0] for expression in self.get_source_expressions()]
+        return f'MATCH ({", ".join(columns)}) AGAINST (%s IN BOOLEAN MODE)', [self.query]
+
+
+def fulltext_index_name(model):
+    '''
+    获取数据模型全文索引的名字
+    :param model: 数据模型
+    :return: 索引名
+    '''
+    return f'{model._meta.db_table}_fulltext'
+
+
+def has_fulltext_index(model, using=DEFAULT_DB_ALIAS):
+    '''
+    检查数据表是否已创建全文索引，结果在进程内缓存
+    :param model: 数据模型
+    :param using: 数据库别名
+    :return: 是否存在
+    '''
+    connection = connections[using]
+    if connection.vendor != 'mysql':
+        return False
+    key = (using, model._meta.db_table)
+    if key not in _index_exists:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT 1 FROM information_schema.statistics '
+                'WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s LIMIT 1',
+                [model._meta.db_table, fulltext_index_name(model)]
+            )
+            _index_exists[key] = cursor.fetchone() is not None
+    return _index_exists[key]
+
+
+def create_fulltext_indexes(using=DEFAULT_DB_ALIAS, **kwargs):
+    '''
+    迁移完成后为检索字段创建ngram全文索引，已存在的索引不重复创建，只在mysql中执行
+    :param using: 数据库别名
+    :return:
+    '''
+    connection = connections[using]
+    if connection.vendor != 'mysql':
+        return
+    quote_name = connection.ops.quote_name
+    for model, fields in FULLTEXT_INDEXES.items():
+        _index_exists.pop((using, model._meta.db_table), None)
+        if has_fulltext_index(model, using):
+            continue
+        columns = ', '.join(quote_name(model._meta.get_field(field).column) for field in fields)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'ALTER TABLE {quote_name(model._meta.db_table)} '
+                f'ADD FULLTEXT INDEX {quote_name(fulltext_index_name(model))} ({columns}) WITH PARSER ngram'
+            )
+        _index_exists[(using, model._meta.db_table)] = True
+
+
+def fulltext_search(queryset, value):
+    '''
+    按关键词检索数据，有全文索引时使用MATCH AGAINST，否则退回到icontains
+    :param queryset: 查询集
+    :param value: 关键词
+    :return: 检索后的查询集
+    '''
+    fields = FULLTEXT_INDEXES[queryset.model]
+    value = value.strip()
+    if len(value) >= NGRAM_TOKEN_SIZE and has_fulltext_index(queryset.model, queryset.db):
+        # 以短语方式匹配，与icontains一样要求关键词连续出现
+        query = '"%s"' % value.replace('"', ' ')
+        return queryset.alias(relevance=Match(*fields, query=query)).filter(relevance__gt=0)
+    condition = Q()
+    for field in fields:
+        condition |= Q(**{f'{field}__icontains': value})
+    return queryset.filter(condition)
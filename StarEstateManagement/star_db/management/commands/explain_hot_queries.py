@@ -0,0 +1,111 @@
+import datetime
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, models, transaction
+from django.db.models import Count
+from django.utils import timezone
+from star_db.models import UserService, UserPayment, Payment, Publicity, Comments, Evaluate, Message
+
+
+def get_hot_queries():
+    '''
+    获取视图中高频执行的查询
+    :return: 查询描述和查询集列表
+    '''
+    week_ago = timezone.now() - datetime.timedelta(weeks=1)
+    return [
+        ('用户服务记录', UserService.objects.filter(username_id=1, order_id=1, type='A')),
+        ('用户缴费记录', UserPayment.objects.filter(username_id=1, name='1')),
+        ('收费记录', Payment.objects.filter(name='1', username_id=1)),
+        ('按类型获取最新公示', Publicity.objects.filter(type=0).order_by('-create_time')[:10]),
+        ('按标题获取收费通知', Publicity.objects.filter(title='1')),
+        ('子评论', Comments.objects.filter(father_id=1)),
+        ('页面评论', Comments.objects.filter(page_id=1, type=1, status=1)),
+        ('按时间范围统计评价', Evaluate.objects.filter(create_time__gte=week_ago, create_time__lt=timezone.now()).
+         values('type').annotate(count=Count('id'))),
+        ('接收人最新消息', Message.objects.filter(recipient_id='1').order_by('-create_time')[:10]),
+    ]
+
+
+def seed_value(field, index):
+    '''
+    根据字段类型生成填充数据
+    :param field: 模型字段
+    :param index: 数据序号
+    :return: 字段值
+    '''
+    if isinstance(field, models.DateTimeField):
+        return timezone.now() - datetime.timedelta(days=index)
+    if isinstance(field, models.BooleanField):
+        return index % 2
+    if isinstance(field, (models.IntegerField, models.ForeignKey)):
+        return index % 50 + 1
+    if isinstance(field, models.DecimalField):
+        return index
+    return str(index % 50)[:field.max_length]
+
+
+def seed(count):
+    '''
+    为高频查询涉及的数据表填充数据，使执行计划接近真实数据量下的结果
+    :param count: 每张表填充的行数
+    :return:
+    '''
+    for model in (UserService, UserPayment, Payment, Publicity, Comments, Evaluate, Message):
+        fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+        objs = []
+        for index in range(count):
+            obj = model(**{field.attname: seed_value(field, index) for field in fields})
+            objs.append(obj)
+        model.objects.bulk_create(objs, batch_size=1000)
+
+
+def find_full_scans(plan):
+    '''
+    从执行计划中找出全表扫描的数据表
+    :param plan: explain的结果
+    :return: 全表扫描的表名列表
+    '''
+    tables = []
+    if connection.vendor == 'mysql':
+        def walk(node):
+            if isinstance(node, dict):
+                if node.get('access_type') == 'ALL':
+                    tables.append(node.get('table_name'))
+                for value in node.values():
+                    walk(value)
+            elif isinstance(node, list):
+                for value in node:
+                    walk(value)
+        walk(json.loads(plan))
+    else:
+        # sqlite的执行计划中SCAN表示遍历整张表或整个索引
+        tables = [line for line in plan.splitlines() if 'SCAN' in line]
+    return tables
+
+
+class Command(BaseCommand):
+    help = '对高频查询执行EXPLAIN，存在全表扫描时返回错误'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0,
+                            help='执行前在事务中为每张表填充的行数，执行后回滚，用于空数据库')
+
+    def handle(self, *args, **options):
+        failed = []
+        with transaction.atomic():
+            if options['seed']:
+                seed(options['seed'])
+            for name, queryset in get_hot_queries():
+                plan = queryset.explain(format='json') if connection.vendor == 'mysql' else queryset.explain()
+                scans = find_full_scans(plan)
+                if scans:
+                    failed.append(name)
+                    self.stdout.write(self.style.ERROR(f'{name}: 全表扫描 {scans}'))
+                else:
+                    self.stdout.write(self.style.SUCCESS(f'{name}: 使用索引'))
+            # 填充的数据只用于生成执行计划，执行后回滚
+            transaction.set_rollback(True)
+        if failed:
+            raise CommandError(f'{len(failed)}条查询存在全表扫描')
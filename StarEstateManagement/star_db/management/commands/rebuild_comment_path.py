@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from star_db.models import Comments
+from utils.data_version import bump_version
+
+
+class Command(BaseCommand):
+    help = '为未生成路径的历史评论补全评论路径'
+
+    def handle(self, *args, **options):
+        # 父评论总是先于子评论创建，按id顺序遍历即可保证父评论路径已生成
+        path_dict = {}
+        update_list = []
+        for comment_id, father_id, path in Comments.objects.order_by('id').values_list('id', 'father_id', 'path'):
+            if not path:
+                path = f'{path_dict.get(father_id, "/")}{comment_id}/'
+                update_list.append(Comments(id=comment_id, path=path))
+            path_dict[comment_id] = path
+        Comments.objects.bulk_update(update_list, ['path'], batch_size=1000)
+        # bulk_update不会触发模型信号，需要手动更新数据版本
+        if update_list:
+            bump_version(Comments)
+        self.stdout.write(f'已补全{len(update_list)}条评论路径')
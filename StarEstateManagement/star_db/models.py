@@ -1,6 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 from utils.constant import AVATAR_DEFAULT_IMAGE, PUBLICITY_DEFAULT_IMAGE
+from utils.data_version import bump_version
 
 
 # Create your models here.
@@ -57,6 +58,14 @@ class Publicity(models.Model):
 
     class Meta:
         db_table = 'publicity'
+        indexes = [
+            # 按类型获取公示及按截止日期判断是否过期
+            models.Index(fields=['type', 'end']),
+            # 按类型获取最新的公示
+            models.Index(fields=['type', 'create_time']),
+            # 按标题获取收费通知
+            models.Index(fields=['title']),
+        ]
 
 
 class ActivityApply(models.Model):
@@ -113,6 +122,10 @@ class UserService(models.Model):
 
     class Meta:
         db_table = 'user_service'
+        indexes = [
+            # 按用户和任务id获取服务记录
+            models.Index(fields=['username', 'order_id', 'type']),
+        ]
 
 
 class Evaluate(models.Model):
@@ -133,6 +146,10 @@ class Evaluate(models.Model):
 
     class Meta:
         db_table = 'evaluate'
+        indexes = [
+            # 按天和按月重建评价汇总时按时间范围统计各类型的评价
+            models.Index(fields=['create_time', 'type']),
+        ]
 
 
 class Comments(models.Model):
@@ -148,6 +165,8 @@ class Comments(models.Model):
     page_id = models.SmallIntegerField(default=0, verbose_name='来源页面id')
     status = models.BooleanField(default=1, verbose_name='发布状态')  # 0屏蔽、1正常
     father_id = models.IntegerField(default=0, null=True, verbose_name='父评论id')
+    # 从根评论到当前评论的id路径，如/1/5/9/，同一楼层的评论拥有相同的前缀
+    path = models.CharField(max_length=255, default='', db_index=True, verbose_name='评论路径')
     good = models.SmallIntegerField(default=0, verbose_name='评论数')
     show = models.BooleanField(default=1, verbose_name='是否显示')
     create_time = models.DateTimeField(max_length=19, auto_now_add=True, verbose_name='创建时间')
@@ -155,6 +174,33 @@ class Comments(models.Model):
 
     class Meta:
         db_table = 'comments'
+        indexes = [
+            # 获取子评论
+            models.Index(fields=['father_id']),
+            # 获取页面下的评论
+            models.Index(fields=['page_id', 'type', 'status']),
+        ]
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # 新增评论后根据父评论的路径生成自身路径
+        if not self.path:
+            parent_path = Comments.objects.filter(id=self.father_id).values_list('path', flat=True).first() \
+                if self.father_id else '/'
+            # 父评论是尚未补全路径的历史评论时不生成路径
+            if parent_path:
+                self.path = f'{parent_path}{self.id}/'
+                Comments.objects.filter(id=self.id).update(path=self.path)
+                # 路径在post_save信号之后写入，需要再次更新数据版本
+                bump_version(Comments)
+
+    def get_thread(self):
+        """
+        获取当前评论及其全部子评论，路径前缀匹配只需一次索引范围查询
+        :return: 查询集
+        """
+        # 路径只包含数字和/，使用istartswith生成不带BINARY的LIKE以便MySQL走索引
+        return Comments.objects.filter(path__istartswith=self.path)
 
 
 class Payment(models.Model):
@@ -172,6 +218,10 @@ class Payment(models.Model):
 
     class Meta:
         db_table = 'payment'
+        indexes = [
+            # 按收费名和发布人获取收费记录
+            models.Index(fields=['name', 'username']),
+        ]
 
 
 class UserPayment(models.Model):
@@ -191,6 +241,10 @@ class UserPayment(models.Model):
 
     class Meta:
         db_table = 'user_payment'
+        indexes = [
+            # 按用户和收费名获取缴费记录
+            models.Index(fields=['username', 'name']),
+        ]
 
 
 class Parking(models.Model):
@@ -249,3 +303,7 @@ class Message(models.Model):
 
     class Meta:
         db_table = 'Message'
+        indexes = [
+            # 获取接收人最新的消息
+            models.Index(fields=['recipient_id', 'create_time']),
+        ]
@@ -0,0 +1,34 @@
+import asyncio
+import weakref
+
+from django.conf import settings
+from redis import asyncio as aioredis
+
+# 异步redis地址，默认与缓存使用同一个redis，缓存配置了多个地址时使用第一个(主节点)
+_location = settings.CACHES['default']['LOCATION']
+ASYNC_REDIS_URL = getattr(settings, 'ASYNC_REDIS_URL', _location[0] if isinstance(_location, (list, tuple))
+                          else _location.split(',')[0])
+# 每个事件循环连接池的最大连接数
+ASYNC_REDIS_MAX_CONNECTIONS = getattr(settings, 'ASYNC_REDIS_MAX_CONNECTIONS', 50)
+# 异步连接只能在创建它的事件循环中使用，按事件循环分别保存客户端
+_clients = weakref.WeakKeyDictionary()
+
+
+def create_client():
+    '''
+    创建异步redis客户端
+    :return: 客户端对象
+    '''
+    return aioredis.Redis.from_url(ASYNC_REDIS_URL, max_connections=ASYNC_REDIS_MAX_CONNECTIONS)
+
+
+def get_async_redis():
+    '''
+    获取当前事件循环的异步redis客户端，每个事件循环只创建一次
+    :return: 客户端对象
+    '''
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = create_client()
+    return client
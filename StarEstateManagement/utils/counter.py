@@ -0,0 +1,67 @@
+import atexit
+import threading
+import time
+from collections import defaultdict
+
+from django.core.cache import cache
+from utils.constant import REDIS_CLIENT, DAY_DATA_TIME
+
+
+class CounterBuffer:
+    """
+    进程内计数缓冲类
+    计数先在内存中累加，再定期通过一次redis管道批量写入，避免每次计数都访问redis
+    """
+
+    def __init__(self, timeout=DAY_DATA_TIME, interval=5):
+        """
+        :param timeout: redis中计数的有效期
+        :param interval: 两次写入redis的最小间隔秒数
+        """
+        self.timeout = timeout
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.counts = defaultdict(int)
+        self.last_flush = time.monotonic()
+
+    def incr(self, key, delta=1):
+        """
+        在内存中累加计数
+        :param key: 缓存键名
+        :param delta: 增加的数量
+        :return:
+        """
+        with self.lock:
+            self.counts[key] += delta
+
+    def flush(self, force=False):
+        """
+        将累加的计数写入redis
+        :param force: 是否忽略写入间隔立即写入
+        :return:
+        """
+        if not force and time.monotonic() - self.last_flush < self.interval:
+            return
+        with self.lock:
+            counts, self.counts = self.counts, defaultdict(int)
+            self.last_flush = time.monotonic()
+        if not counts:
+            return
+        pipe = REDIS_CLIENT.pipeline(transaction=False)
+        for key, delta in counts.items():
+            redis_key = cache.make_key(key)
+            # 与get_or_set一致，计数不存在时初始化为0并设置有效期
+            pipe.set(redis_key, 0, ex=self.timeout, nx=True)
+            pipe.incrby(redis_key, delta)
+        try:
+            pipe.execute()
+        except Exception:
+            # 写入失败时将计数放回缓冲区等待下次写入
+            for key, delta in counts.items():
+                self.incr(key, delta)
+
+
+# 数据库和redis调用次数计数缓冲
+call_counter = CounterBuffer()
+# 进程退出前写入剩余的计数
+atexit.register(call_counter.flush, True)
@@ -0,0 +1,17 @@
+class QuerysetOptimizeMixin:
+    """
+    列表查询优化混入类
+    列表接口根据序列化器启用的字段自动联表查询外键数据并只查询需要的列
+    """
+
+    def filter_queryset(self, queryset):
+        """
+        :param queryset: 待过滤的查询集
+        :return: 过滤并优化后的查询集
+        """
+        queryset = super().filter_queryset(queryset)
+        if self.action == 'list':
+            optimize = getattr(self.get_serializer(), 'optimize_queryset', None)
+            if optimize:
+                queryset = optimize(queryset)
+        return queryset
@@ -1,7 +1,135 @@
+import base64
+from collections import OrderedDict
+
+import ujson
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+
+
+class KeysetPagination(PageNumberPagination):
+    """
+    游标分页类
+    请求携带cursor参数时按(create_time, id)定位下一页，每页只需一次索引查找，不执行count和offset
+    未携带cursor参数时保持原有的页码分页
+    """
+    # 游标分页默认每页的数据量，游标分页总是返回有限的一页数据
+    cursor_page_size = 20
+    # 每页数据量参数
+    page_size_query_param = 'page_size'
+    # 每页最多的数据量
+    max_page_size = 1000
+    # 游标参数，值为空表示第一页
+    cursor_query_param = 'cursor'
+    # 排序字段，最后一个字段必须唯一
+    ordering = ('-create_time', '-id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        '''
+        分页查询
+        :param queryset: 查询集
+        :param request: 请求对象
+        :param view: 视图对象
+        :return: 当前页的数据列表
+        '''
+        self.keyset = self.cursor_query_param in request.query_params
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+        page_size = self.get_cursor_page_size(request.query_params)
+        self.request = request
+        queryset = queryset.order_by(*self.ordering)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(self.get_position_filter(queryset.model, self.decode_cursor(cursor)))
+        # 多取一条判断是否还有下一页
+        results = list(queryset[:page_size + 1])
+        self.has_next = len(results) > page_size
+        self.page = results[:page_size]
+        return self.page
+
+    def get_cursor_page_size(self, query_params):
+        '''
+        获取游标分页每页的数据量，参数无效时使用默认值，不超过每页最多的数据量
+        :param query_params: 请求参数
+        :return: 每页数据量
+        '''
+        try:
+            page_size = int(query_params[self.page_size_query_param])
+            if page_size <= 0:
+                raise ValueError
+        except (KeyError, ValueError):
+            page_size = self.page_size or self.cursor_page_size
+        return min(page_size, self.max_page_size)
+
+    def get_paginated_response(self, data):
+        '''
+        封装分页响应数据，游标分页返回下一页游标，没有下一页时为None
+        :param data: 当前页序列化后的数据
+        :return: 响应对象
+        '''
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.encode_cursor(self.page[-1]) if self.has_next else None),
+            ('results', data)
+        ]))
+
+    def get_position_filter(self, model, values):
+        '''
+        生成位于游标之后的查询条件，如降序时为 a < x or (a == x and b < y)
+        :param model: 数据模型
+        :param values: 游标中各排序字段的值
+        :return: 查询条件
+        '''
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            try:
+                value = model._meta.get_field(name).to_python(value)
+            except (ValidationError, TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+            if value is None:
+                raise NotFound(self.invalid_cursor_message)
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def encode_cursor(self, instance):
+        '''
+        将最后一条数据的排序字段值编码为游标
+        :param instance: 当前页最后一条数据
+        :return: 游标字符串
+        '''
+        values = []
+        for field in self.ordering:
+            value = getattr(instance, field.lstrip('-'))
+            values.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+        return base64.urlsafe_b64encode(ujson.dumps(values).encode()).decode()
+
+    def decode_cursor(self, cursor):
+        '''
+        解析游标
+        :param cursor: 游标字符串
+        :return: 各排序字段的值
+        '''
+        try:
+            values = ujson.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        # 游标由encode_cursor生成，各排序字段的值只能是字符串或整数
+        if not all(isinstance(value, (str, int)) and not isinstance(value, bool) for value in values):
+            raise NotFound(self.invalid_cursor_message)
+        return values
 
 
-class CommentsPagination(PageNumberPagination):
+class CommentsPagination(KeysetPagination):
     # 每页的数据量
     page_size = 1000
     # 每页数据量参数
@@ -1,26 +1,119 @@
+import datetime
+
 import django_filters
+from django.conf import settings
+from django.utils import timezone
+from django_filters.constants import EMPTY_VALUES
 from django_filters.rest_framework import FilterSet
+from star_db.fulltext import fulltext_search
 from star_db.models import User, ActivityApply, RepairsApply, UserService, Evaluate, Comments, Payment, Parking, House, \
     Message, UserPayment
 
 
-class UserFilter(FilterSet):
+class FullTextFilter(django_filters.CharFilter):
+    """
+    全文检索过滤器，检索字段由star_db.fulltext.FULLTEXT_INDEXES指定
+    """
+
+    def filter(self, qs, value):
+        if value in EMPTY_VALUES:
+            return qs
+        return fulltext_search(qs, value)
+
+
+# 支持的时间前缀格式及对应的时间跨度
+DATETIME_PREFIX_FORMATS = (
+    ('%Y-%m-%d %H:%M:%S', datetime.timedelta(seconds=1)),
+    ('%Y-%m-%d %H:%M', datetime.timedelta(minutes=1)),
+    ('%Y-%m-%d %H', datetime.timedelta(hours=1)),
+    ('%Y-%m-%d', datetime.timedelta(days=1)),
+    ('%Y-%m', 'month'),
+    ('%Y', 'year'),
+)
+
+
+def get_prefix_range(value):
+    '''
+    将时间前缀转换为时间范围，如2022-10转换为[2022-10-01, 2022-11-01)
+    :param value: 时间前缀
+    :return: 开始时间和结束时间，无法解析时为None
+    '''
+    value = value.strip().replace('T', ' ')
+    for time_format, span in DATETIME_PREFIX_FORMATS:
+        try:
+            start = datetime.datetime.strptime(value, time_format)
+        except ValueError:
+            continue
+        if span == 'month':
+            end = (start + datetime.timedelta(days=32)).replace(day=1)
+        elif span == 'year':
+            end = start.replace(year=start.year + 1)
+        else:
+            end = start + span
+        if settings.USE_TZ:
+            start, end = timezone.make_aware(start), timezone.make_aware(end)
+        return start, end
+    return None
+
+
+class NumberInFilter(django_filters.BaseInFilter, django_filters.NumberFilter):
+    """
+    数值过滤器，多个值用逗号分隔，如status=0,1
+    """
+
+
+class DateTimePrefixFilter(django_filters.CharFilter):
+    """
+    时间前缀过滤器，按前缀对应的时间范围查询以使用索引，无法解析的格式按原有方式模糊匹配
+    """
+
+    def filter(self, qs, value):
+        if value in EMPTY_VALUES:
+            return qs
+        time_range = get_prefix_range(value)
+        if time_range is None:
+            return qs.filter(**{f'{self.field_name}__icontains': value})
+        return qs.filter(**{f'{self.field_name}__gte': time_range[0], f'{self.field_name}__lt': time_range[1]})
+
+
+class DayFilter(django_filters.DateFilter):
+    """
+    日期过滤器，查询指定日期当天的数据
+    """
+
+    def filter(self, qs, value):
+        if value in EMPTY_VALUES:
+            return qs
+        start, end = get_prefix_range(value.isoformat())
+        return qs.filter(**{f'{self.field_name}__gte': start, f'{self.field_name}__lt': end})
+
+
+class CreateTimeFilterSet(FilterSet):
+    """
+    创建时间过滤器基类，create_time按前缀查询，create_time_after和create_time_before按范围查询，date按日期查询
+    """
+    create_time = DateTimePrefixFilter(field_name='create_time')
+    create_time_after = django_filters.DateTimeFilter(field_name='create_time', lookup_expr='gte')
+    create_time_before = django_filters.DateTimeFilter(field_name='create_time', lookup_expr='lte')
+    date = DayFilter(field_name='create_time')
+
+
+class UserFilter(CreateTimeFilterSet):
     name = django_filters.CharFilter(field_name='name', lookup_expr='icontains')
-    group = django_filters.CharFilter(field_name='group', lookup_expr='icontains')
-    status = django_filters.CharFilter(field_name='status', lookup_expr='icontains')
-    create_time = django_filters.CharFilter(field_name='create_time', lookup_expr='icontains')
-    update_time = django_filters.CharFilter(field_name='update_time', lookup_expr='icontains')
+    group = NumberInFilter(field_name='group')
+    status = NumberInFilter(field_name='status')
+    update_time = DateTimePrefixFilter(field_name='update_time')
 
     class Meta:
         models = User
         filter_fields = ['name', 'group', 'status', 'create_time', 'update_time']
 
 
-class PublicityFilter(FilterSet):
+class PublicityFilter(CreateTimeFilterSet):
+    q = FullTextFilter()
     user_name = django_filters.CharFilter(field_name='username__name', lookup_expr='icontains')
-    type = django_filters.CharFilter(field_name='type', lookup_expr='icontains')
-    status = django_filters.CharFilter(field_name='status', lookup_expr='icontains')
-    create_time = django_filters.CharFilter(field_name='create_time', lookup_expr='icontains')
+    type = NumberInFilter(field_name='type')
+    status = NumberInFilter(field_name='status')
 
     class Meta:
         models = User
@@ -35,56 +128,54 @@ class ActivityApplyFilter(FilterSet):
         filter_fields = ['a_name']
 
 
-class RepairsFilter(FilterSet):
+class RepairsFilter(CreateTimeFilterSet):
+    q = FullTextFilter()
     name = django_filters.CharFilter(field_name='name', lookup_expr='icontains')
-    type = django_filters.CharFilter(field_name='type', lookup_expr='icontains')
-    status = django_filters.CharFilter(field_name='status', lookup_expr='icontains')
-    create_time = django_filters.CharFilter(field_name='create_time', lookup_expr='icontains')
+    type = django_filters.CharFilter(field_name='type', lookup_expr='istartswith')
+    status = NumberInFilter(field_name='status')
 
     class Meta:
         models = RepairsApply
         filter_fields = ['name', 'type', 'status', 'create_time']
 
 
-class ServiceFilter(FilterSet):
+class ServiceFilter(CreateTimeFilterSet):
+    q = FullTextFilter()
     name = django_filters.CharFilter(field_name='name', lookup_expr='icontains')
-    type = django_filters.CharFilter(field_name='type', lookup_expr='icontains')
-    status = django_filters.CharFilter(field_name='status', lookup_expr='icontains')
-    create_time = django_filters.CharFilter(field_name='create_time', lookup_expr='icontains')
+    type = django_filters.CharFilter(field_name='type', lookup_expr='istartswith')
+    status = NumberInFilter(field_name='status')
 
     class Meta:
         models = UserService
         filter_fields = ['name', 'type', 'status', 'create_time']
 
 
-class EvaluateFilter(FilterSet):
+class EvaluateFilter(CreateTimeFilterSet):
     name = django_filters.CharFilter(field_name='name', lookup_expr='icontains')
-    type = django_filters.CharFilter(field_name='type', lookup_expr='icontains')
-    status = django_filters.CharFilter(field_name='status', lookup_expr='icontains')
-    create_time = django_filters.CharFilter(field_name='create_time', lookup_expr='icontains')
+    type = NumberInFilter(field_name='type')
+    status = NumberInFilter(field_name='status')
 
     class Meta:
         models = Evaluate
         filter_fields = ['u_id', 'name', 'type', 'status', 'create_time']
 
 
-class CommentsFilter(FilterSet):
-    type = django_filters.CharFilter(field_name='type', lookup_expr='icontains')
-    page_id = django_filters.CharFilter(field_name='page_id', lookup_expr='icontains')
+class CommentsFilter(CreateTimeFilterSet):
+    q = FullTextFilter()
+    type = NumberInFilter(field_name='type')
+    page_id = NumberInFilter(field_name='page_id')
     user_name = django_filters.CharFilter(field_name='username__name', lookup_expr='icontains')
-    status = django_filters.CharFilter(field_name='status', lookup_expr='icontains')
-    create_time = django_filters.CharFilter(field_name='create_time', lookup_expr='icontains')
+    status = NumberInFilter(field_name='status')
 
     class Meta:
         models = Comments
         filter_fields = ['type', 'page_id', 'father_id', 'status', 'create_time', 'user_name']
 
 
-class UserPaymentFilter(FilterSet):
+class UserPaymentFilter(CreateTimeFilterSet):
     user_id = django_filters.CharFilter(field_name='username__id')
     name = django_filters.CharFilter(field_name='name', lookup_expr='icontains')
-    status = django_filters.CharFilter(field_name='status', lookup_expr='icontains')
-    create_time = django_filters.CharFilter(field_name='create_time', lookup_expr='icontains')
+    status = NumberInFilter(field_name='status')
 
     class Meta:
         models = UserPayment
@@ -1,20 +1,107 @@
+import copy
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
 from rest_framework import serializers
+from rest_framework.relations import ManyRelatedField
+
+
+class PrefetchListSerializer(serializers.ListSerializer):
+    """
+    批量预取列表序列化器
+    序列化多条数据前先将整页数据交给子序列化器的prefetch方法批量查询关联数据，避免逐行查询
+    """
+
+    def to_representation(self, data):
+        """
+        :param data: 待序列化的数据列表或查询集
+        :return: 序列化后的数据列表
+        """
+        iterable = data.all() if isinstance(data, models.manager.BaseManager) else data
+        # 尚未执行的查询集根据当前字段集合优化为单条联表查询
+        optimize = getattr(self.child, 'optimize_queryset', None)
+        if optimize and isinstance(iterable, models.QuerySet) and iterable._result_cache is None:
+            iterable = optimize(iterable)
+        # 取出整页数据，保证查询集只执行一次
+        items = list(iterable)
+        # 如果子序列化器定义了prefetch方法则一次性预取整页关联数据
+        prefetch = getattr(self.child, 'prefetch', None)
+        if prefetch and items:
+            prefetch(items)
+        return [self.child.to_representation(item) for item in items]
 
 
 class DynamicFieldsModelSerializer(serializers.ModelSerializer):
+    # 按(序列化器类, 字段元组)缓存裁剪后的字段声明，避免每次实例化都重新构建全部字段
+    _fields_cache = {}
+
     def __init__(self, *args, **kwargs):
         fields = kwargs.pop('fields', None)  # 提取fields
+        # fields参数为空，则取全部字段
+        self.allowed_fields = tuple(sorted(set(fields))) if fields else None
 
         # 实例化父类
         super(DynamicFieldsModelSerializer, self).__init__(*args, **kwargs)
 
-        if fields is not None:
+    def get_fields(self):
+        """
+        从缓存中获取裁剪后的字段声明并复制一份供当前实例绑定
+        :return: 当前实例的字段字典
+        """
+        key = (self.__class__, self.allowed_fields)
+        declared = self._fields_cache.get(key)
+        if declared is None:
+            declared = super().get_fields()
             # 删除fields参数中未指定的任何字段
-            allowed = set(fields)
-            existing = set(self.fields.keys())
-            if allowed:
-                for field_name in existing - allowed:
-                    self.fields.pop(field_name)
-            else:
-                # fields参数为空，则取全部字段
-                pass
\ No newline at end of file
+            if self.allowed_fields is not None:
+                declared = OrderedDict(
+                    (name, field) for name, field in declared.items() if name in self.allowed_fields
+                )
+            self._fields_cache[key] = declared
+        # 缓存中的字段不绑定到任何实例，普通字段浅复制即可，嵌套序列化器需要深复制
+        return OrderedDict(
+            (name, copy.deepcopy(field) if isinstance(field, (serializers.BaseSerializer, ManyRelatedField))
+             else copy.copy(field)) for name, field in declared.items()
+        )
+
+    def optimize_queryset(self, queryset):
+        """
+        根据当前启用的字段的source路径为查询集添加select_related和only
+        :param queryset: 待优化的查询集
+        :return: 只查询所需列并联表获取外键数据的查询集
+        """
+        related = set()
+        # 主键始终需要查询，自定义方法字段依赖主键获取数据
+        only = {queryset.model._meta.pk.name}
+        # 如果存在无法推断所需列的字段则不限制查询列
+        defer_safe = True
+        for field in self.fields.values():
+            # 只写字段和以整个对象为数据源的字段不需要额外的列
+            if field.write_only or field.source == '*':
+                continue
+            path = []
+            model = queryset.model
+            for index, attr in enumerate(field.source_attrs):
+                try:
+                    model_field = model._meta.get_field(attr)
+                except FieldDoesNotExist:
+                    # source指向属性或方法，无法确定依赖的列
+                    defer_safe = False
+                    break
+                if not model_field.concrete or model_field.many_to_many:
+                    defer_safe = False
+                    break
+                path.append(model_field.name)
+                only.add('__'.join(path))
+                # 跨外键访问时联表查询
+                if model_field.is_relation and index < len(field.source_attrs) - 1:
+                    related.add('__'.join(path))
+                    model = model_field.related_model
+                else:
+                    break
+        if related:
+            queryset = queryset.select_related(*related)
+        if defer_safe:
+            queryset = queryset.only(*only)
+        return queryset
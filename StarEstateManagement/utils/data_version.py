@@ -0,0 +1,28 @@
+from utils.constant import REDIS_CLIENT
+
+
+def version_key(model):
+    '''
+    获取数据模型版本号的redis键名
+    :param model: 数据模型
+    :return: 键名
+    '''
+    return f'version:{model._meta.label_lower}'
+
+
+def get_version(model):
+    '''
+    获取数据模型当前的版本号，数据每次变更版本号+1
+    :param model: 数据模型
+    :return: 版本号
+    '''
+    return int(REDIS_CLIENT.get(version_key(model)) or 0)
+
+
+def bump_version(model):
+    '''
+    数据模型发生变更时版本号+1，依赖版本号的缓存随之失效
+    :param model: 数据模型
+    :return: 新的版本号
+    '''
+    return REDIS_CLIENT.incr(version_key(model))
@@ -0,0 +1,201 @@
+import datetime
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from star_db.models import Evaluate
+from utils.constant import REDIS_CLIENT
+from utils.redis_script import ROLLUP_INCR_SCRIPT, ROLLUP_BEGIN_SCRIPT, ROLLUP_COMMIT_SCRIPT
+
+# 评价等级及对应的分数条件，分数小于3为差评，大于等于3小于5为一般，等于5为好评
+EVALUATE_LEVELS = {
+    'praise': Q(score__gte=5),
+    'general': Q(score__gte=3, score__lt=5),
+    'negative': Q(score__lt=3),
+}
+# 按天和按月汇总数据的有效期，过期后读取时从数据库重建
+ROLLUP_SAVE_TIME = {
+    'day': 60 * 60 * 24 * 40,
+    'month': 60 * 60 * 24 * 400,
+}
+# 重建标记的有效期，重建进程异常退出时标记自动过期
+ROLLUP_BUILD_TIME = 60
+
+
+def get_level(score):
+    '''
+    根据分数获取评价等级
+    :param score: 评价分数
+    :return: 评价等级，没有分数时为None
+    '''
+    if score is None:
+        return None
+    if score < 3:
+        return 'negative'
+    if score < 5:
+        return 'general'
+    return 'praise'
+
+
+def local_date(value):
+    '''
+    获取时间对应的本地日期
+    :param value: 时间
+    :return: 日期
+    '''
+    return (timezone.localtime(value) if timezone.is_aware(value) else value).date()
+
+
+def today():
+    '''
+    获取今天的本地日期
+    :return: 日期
+    '''
+    return local_date(timezone.now())
+
+
+def rollup_key(period, day):
+    '''
+    获取汇总数据的redis键名
+    :param period: 汇总周期，day或month
+    :param day: 所在日期
+    :return: 键名
+    '''
+    if period == 'day':
+        return f'evaluate_rollup:day:{day:%Y-%m-%d}'
+    return f'evaluate_rollup:month:{day:%Y-%m}'
+
+
+def period_range(period, day):
+    '''
+    获取汇总周期的起止时间
+    :param period: 汇总周期，day或month
+    :param day: 所在日期
+    :return: 开始时间和结束时间，左闭右开
+    '''
+    if period == 'day':
+        start = datetime.datetime.combine(day, datetime.time.min)
+        end = start + datetime.timedelta(days=1)
+    else:
+        start = datetime.datetime.combine(day.replace(day=1), datetime.time.min)
+        end = (start + datetime.timedelta(days=32)).replace(day=1)
+    if settings.USE_TZ:
+        start, end = timezone.make_aware(start), timezone.make_aware(end)
+    return start, end
+
+
+def update_rollup(instance, step):
+    '''
+    评价新增或删除时增量更新所在日和所在月的汇总数据
+    在事务提交后执行，保证此后开始的重建能统计到本次变更
+    :param instance: 评价对象
+    :param step: 增量，新增为1，删除为-1
+    :return:
+    '''
+    level = get_level(instance.score)
+    if level is None or instance.create_time is None:
+        return
+    day = local_date(instance.create_time)
+    keys = [rollup_key('day', day), rollup_key('month', day)]
+    transaction.on_commit(lambda: ROLLUP_INCR_SCRIPT(keys=keys, args=[f'{int(instance.type)}:{level}', step]))
+
+
+def invalidate_rollup(instance):
+    '''
+    评价修改后删除所在日和所在月的汇总数据，下次读取时重建
+    :param instance: 评价对象
+    :return:
+    '''
+    if instance.create_time is None:
+        return
+    day = local_date(instance.create_time)
+    keys = [rollup_key('day', day), rollup_key('month', day)]
+    transaction.on_commit(lambda: REDIS_CLIENT.delete(*keys))
+
+
+def build_rollup(period, day):
+    '''
+    从数据库统计一个周期内各类型各等级的评价数并写入redis
+    统计前写入重建标记，统计期间发生增量更新时标记被删除，统计结果只返回不写入，下次读取时重新统计
+    :param period: 汇总周期，day或month
+    :param day: 所在日期
+    :return: 汇总数据
+    '''
+    key = rollup_key(period, day)
+    token = uuid.uuid4().hex
+    if not ROLLUP_BEGIN_SCRIPT(keys=[key], args=[token, ROLLUP_BUILD_TIME]):
+        # 其他进程已完成重建
+        data = REDIS_CLIENT.hgetall(key)
+        if b'_built' in data:
+            return {field.decode(): int(value) for field, value in data.items()}
+    start, end = period_range(period, day)
+    queryset = Evaluate.objects.filter(create_time__gte=start, create_time__lt=end).values('type').annotate(
+        **{level: Count('id', filter=condition) for level, condition in EVALUATE_LEVELS.items()}
+    )
+    rollup = {'_built': 1}
+    for item in queryset:
+        for level in EVALUATE_LEVELS:
+            rollup[f'{int(item["type"])}:{level}'] = item[level]
+    args = [token, ROLLUP_SAVE_TIME[period]]
+    for field, value in rollup.items():
+        if field != '_built':
+            args += [field, value]
+    ROLLUP_COMMIT_SCRIPT(keys=[key], args=args)
+    return rollup
+
+
+def get_rollups(period, days):
+    '''
+    批量获取多个周期的汇总数据，未构建的汇总从数据库重建
+    :param period: 汇总周期，day或month
+    :param days: 各周期所在日期列表
+    :return: 与日期列表对应的汇总数据列表
+    '''
+    pipe = REDIS_CLIENT.pipeline(transaction=False)
+    for day in days:
+        pipe.hgetall(rollup_key(period, day))
+    rollups = []
+    for day, data in zip(days, pipe.execute()):
+        if b'_built' in data:
+            rollups.append({key.decode(): int(value) for key, value in data.items()})
+        else:
+            rollups.append(build_rollup(period, day))
+    return rollups
+
+
+def get_trend(range_type, evaluate_type=0):
+    '''
+    获取评价趋势数据
+    :param range_type: 统计范围，week按星期数返回最近7天，month返回最近30天，year返回最近12个月
+    :param evaluate_type: 评价类型，0评价 1反馈
+    :return: 各等级评价数列表和对应的日期标签
+    '''
+    now = today()
+    if range_type == 'year':
+        period = 'month'
+        days = []
+        month = now.replace(day=1)
+        for i in range(12):
+            days.insert(0, month)
+            month = (month - datetime.timedelta(days=1)).replace(day=1)
+        labels = [day.strftime('%Y-%m') for day in days]
+    else:
+        period = 'day'
+        count = 30 if range_type == 'month' else 7
+        days = [now - datetime.timedelta(days=i) for i in range(count - 1, -1, -1)]
+        labels = [day.strftime('%m-%d') for day in days]
+    rollups = get_rollups(period, days)
+    if range_type not in ('month', 'year'):
+        # 按星期数返回，星期日为0
+        evaluate_list = {level: [0] * 7 for level in EVALUATE_LEVELS}
+        for day, rollup in zip(days, rollups):
+            for level in EVALUATE_LEVELS:
+                evaluate_list[level][day.isoweekday() % 7] = rollup.get(f'{evaluate_type}:{level}', 0)
+        return evaluate_list, None
+    evaluate_list = {
+        level: [rollup.get(f'{evaluate_type}:{level}', 0) for rollup in rollups] for level in EVALUATE_LEVELS
+    }
+    return evaluate_list, labels
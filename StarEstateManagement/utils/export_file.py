@@ -0,0 +1,137 @@
+import csv
+import tempfile
+from io import StringIO
+
+import xlsxwriter
+from star_db.models import UserService, UserPayment, User, Publicity, RepairsApply, Evaluate, Comments
+
+# 可导出的数据模型，下标与请求参数type对应
+EXPORT_MODELS = [UserService, UserPayment, User, Publicity, RepairsApply, Evaluate, Comments]
+# 每次从数据库读取的行数
+EXPORT_CHUNK_SIZE = 2000
+# 流式导出支持的文件格式及响应类型
+EXPORT_CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+def parse_export_type(value):
+    '''
+    解析请求参数中的数据类型
+    :param value: 请求参数type的值
+    :return: 数据类型，缺失、非数字或超出范围时为None
+    '''
+    try:
+        data_type = int(value)
+    except (TypeError, ValueError):
+        return None
+    return data_type if 0 <= data_type < len(EXPORT_MODELS) else None
+
+
+def get_export_queryset(data_type, user_id):
+    '''
+    获取需要导出的数据查询集
+    :param data_type: 数据类型，0和1只导出当前用户的数据
+    :param user_id: 当前用户id
+    :return: 数据模型和查询集
+    '''
+    obj = EXPORT_MODELS[data_type]
+    queryset = obj.objects.filter(username__id=user_id) if data_type < 2 else obj.objects.all()
+    return obj, queryset.order_by('pk')
+
+
+def get_export_fields(obj):
+    '''
+    获取导出的字段名列表，与values()返回的字段一致
+    :param obj: 数据模型
+    :return: 字段名列表
+    '''
+    return [field.attname for field in obj._meta.concrete_fields]
+
+
+def iter_rows(queryset, fields):
+    '''
+    分块读取数据行，内存中只保留当前块
+    :param queryset: 查询集
+    :param fields: 字段名列表
+    :return: 数据行生成器
+    '''
+    return queryset.values_list(*fields).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def iter_csv(queryset, fields):
+    '''
+    按块生成csv文件内容
+    :param queryset: 查询集
+    :param fields: 字段名列表
+    :return: csv文本块生成器
+    '''
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    # 写入BOM和表头，保证excel打开中文不乱码
+    buffer.write('\ufeff')
+    writer.writerow(fields)
+    for index, row in enumerate(iter_rows(queryset, fields), 1):
+        writer.writerow(row)
+        # 每读取一块数据输出一次并清空缓冲区
+        if index % EXPORT_CHUNK_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+    yield buffer.getvalue()
+
+
+def write_csv(queryset, fields, output, on_chunk=None):
+    '''
+    按块将csv内容写入文件
+    :param queryset: 查询集
+    :param fields: 字段名列表
+    :param output: 以文本模式打开的输出文件对象
+    :param on_chunk: 每写完一块数据后的回调，参数为已写入的行数
+    :return:
+    '''
+    for index, chunk in enumerate(iter_csv(queryset, fields), 1):
+        output.write(chunk)
+        if on_chunk:
+            on_chunk(index * EXPORT_CHUNK_SIZE)
+
+
+def write_xlsx(queryset, fields, output, on_chunk=None):
+    '''
+    以常量内存模式逐行写入xlsx文件，已写完的行会刷新到临时文件中
+    :param queryset: 查询集
+    :param fields: 字段名列表
+    :param output: 输出的文件对象
+    :param on_chunk: 每写完一块数据后的回调，参数为已写入的行数
+    :return: 写入的数据行数
+    '''
+    wb = xlsxwriter.Workbook(output, {
+        'constant_memory': True,
+        'default_date_format': 'yyyy-mm-dd hh:mm:ss',
+        'remove_timezone': True
+    })
+    sheet = wb.add_worksheet(u'表格')
+    # 将字段名写入文档第一行
+    sheet.write_row(0, 0, fields)
+    row = 0
+    # 将数据按行写入文档
+    for row, items in enumerate(iter_rows(queryset, fields), 1):
+        sheet.write_row(row, 0, items)
+        if on_chunk and row % EXPORT_CHUNK_SIZE == 0:
+            on_chunk(row)
+    wb.close()
+    return row
+
+
+def build_xlsx_file(queryset, fields):
+    '''
+    生成xlsx临时文件，文件关闭后自动删除
+    :param queryset: 查询集
+    :param fields: 字段名列表
+    :return: 已移动到开头的临时文件对象
+    '''
+    output = tempfile.TemporaryFile()
+    write_xlsx(queryset, fields, output)
+    output.seek(0)
+    return output
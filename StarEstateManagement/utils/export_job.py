@@ -0,0 +1,129 @@
+import os
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from utils.constant import REDIS_CLIENT
+from utils.data_version import get_version
+from utils.export_file import get_export_queryset, get_export_fields, write_csv, write_xlsx
+
+# 导出文件保存目录
+EXPORT_ROOT = getattr(settings, 'EXPORT_ROOT', os.path.join(tempfile.gettempdir(), 'star_export'))
+# 导出任务及导出文件的保存时间
+EXPORT_SAVE_TIME = 60 * 60
+# 后台导出线程池，限制同时执行的导出任务数
+executor = ThreadPoolExecutor(max_workers=getattr(settings, 'EXPORT_WORKERS', 2), thread_name_prefix='export')
+
+
+def job_key(job_id):
+    '''
+    获取导出任务信息的redis键名
+    :param job_id: 任务id
+    :return: 键名
+    '''
+    return f'export_job:{job_id}'
+
+
+def get_job(job_id):
+    '''
+    获取导出任务信息
+    :param job_id: 任务id
+    :return: 任务信息字典，任务不存在时为空字典
+    '''
+    return {key.decode(): value.decode() for key, value in REDIS_CLIENT.hgetall(job_key(job_id)).items()}
+
+
+def update_job(job_id, **kwargs):
+    '''
+    更新导出任务信息
+    :param job_id: 任务id
+    :param kwargs: 需要更新的字段
+    :return:
+    '''
+    REDIS_CLIENT.hset(job_key(job_id), mapping=kwargs)
+
+
+def clear_expired_files():
+    '''
+    删除超过保存时间的导出文件
+    :return:
+    '''
+    expire_time = time.time() - EXPORT_SAVE_TIME
+    for name in os.listdir(EXPORT_ROOT):
+        path = os.path.join(EXPORT_ROOT, name)
+        try:
+            if os.path.getmtime(path) < expire_time:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def submit_export(data_type, user_id, file_format):
+    '''
+    提交导出任务，相同用户、相同类型且数据版本未变化的导出直接复用已有任务
+    :param data_type: 数据类型
+    :param user_id: 当前用户id
+    :param file_format: 导出格式，csv或xlsx
+    :return: 任务id
+    '''
+    obj, queryset = get_export_queryset(data_type, user_id)
+    cache_key = f'export_cache:{data_type}:{user_id}:{file_format}:{get_version(obj)}'
+    job_id = REDIS_CLIENT.get(cache_key)
+    if job_id:
+        job_id = job_id.decode()
+        job = get_job(job_id)
+        # 任务未失败且文件仍然存在时复用
+        if job and job.get('status') != 'failed' and (job.get('status') != 'done' or os.path.exists(job.get('path'))):
+            return job_id
+        REDIS_CLIENT.delete(cache_key)
+    job_id = uuid.uuid4().hex
+    # 同时提交相同导出时只创建一个任务
+    if not REDIS_CLIENT.set(cache_key, job_id, nx=True, ex=EXPORT_SAVE_TIME):
+        return REDIS_CLIENT.get(cache_key).decode()
+    update_job(job_id, status='pending', progress=0, user_id=user_id, format=file_format,
+               filename=f'{obj.__name__}.{file_format}')
+    REDIS_CLIENT.expire(job_key(job_id), EXPORT_SAVE_TIME)
+    os.makedirs(EXPORT_ROOT, exist_ok=True)
+    clear_expired_files()
+    executor.submit(run_export, job_id, data_type, user_id, file_format)
+    return job_id
+
+
+def run_export(job_id, data_type, user_id, file_format):
+    '''
+    在后台线程中分块生成导出文件并记录进度
+    :param job_id: 任务id
+    :param data_type: 数据类型
+    :param user_id: 当前用户id
+    :param file_format: 导出格式，csv或xlsx
+    :return:
+    '''
+    close_old_connections()
+    try:
+        obj, queryset = get_export_queryset(data_type, user_id)
+        fields = get_export_fields(obj)
+        total = queryset.count()
+        update_job(job_id, status='running', total=total)
+
+        def on_chunk(row):
+            # 写完前进度最多显示99
+            update_job(job_id, progress=min(row * 100 // total, 99) if total else 99)
+
+        path = os.path.join(EXPORT_ROOT, f'{job_id}.{file_format}')
+        # 先写入临时文件，写完后再重命名，避免下载到不完整的文件
+        part_path = path + '.part'
+        if file_format == 'csv':
+            with open(part_path, 'w', encoding='utf-8', newline='') as output:
+                write_csv(queryset, fields, output, on_chunk)
+        else:
+            with open(part_path, 'wb') as output:
+                write_xlsx(queryset, fields, output, on_chunk)
+        os.replace(part_path, path)
+        update_job(job_id, status='done', progress=100, path=path)
+    except Exception:
+        update_job(job_id, status='failed')
+    finally:
+        close_old_connections()
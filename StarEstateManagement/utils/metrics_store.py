@@ -0,0 +1,129 @@
+import datetime
+import struct
+import time
+from collections import OrderedDict
+
+import psutil
+from utils.constant import REDIS_CLIENT
+
+# 每个数据点的存储格式：时间段开始时间戳、cpu使用率之和、内存使用率之和、采样次数，共16字节
+SLOT = struct.Struct('<IffI')
+# 各精度的时间间隔(秒)和保存的数据点数，分别保存1小时、1天和31天的数据
+METRICS_TIERS = OrderedDict([
+    ('10s', (10, 360)),
+    ('1m', (60, 60 * 24)),
+    ('1h', (3600, 24 * 31)),
+])
+# 历史数据范围对应的精度和时长(秒)
+HISTORY_RANGES = {
+    'hour': ('10s', 60 * 60),
+    'day': ('1m', 60 * 60 * 24),
+    'week': ('1h', 60 * 60 * 24 * 7),
+    'month': ('1h', 60 * 60 * 24 * 31),
+}
+# 采样间隔(秒)
+METRICS_INTERVAL = METRICS_TIERS['10s'][0]
+
+
+def tier_key(tier):
+    '''
+    获取环形缓冲区的redis键名
+    :param tier: 精度
+    :return: 键名
+    '''
+    return f'metrics:{tier}'
+
+
+class CpuSampler(object):
+    """
+    cpu使用率采集器，根据两次cpu时间的差值计算期间的平均使用率
+    psutil.cpu_percent(interval=None)的计算起点是进程全局的，多个调用方会互相重置计算区间，
+    每个调用方使用各自的采集器保存上次的cpu时间
+    """
+
+    def __init__(self):
+        self.last = self.cpu_times()
+
+    @staticmethod
+    def cpu_times():
+        '''
+        获取cpu总时间和空闲时间
+        :return: 总时间和空闲时间
+        '''
+        times = psutil.cpu_times()
+        # guest时间已包含在user时间中，iowait属于空闲时间
+        total = sum(times) - getattr(times, 'guest', 0) - getattr(times, 'guest_nice', 0)
+        return total, times.idle + getattr(times, 'iowait', 0)
+
+    def percent(self):
+        '''
+        获取距上次调用期间的cpu平均使用率
+        :return: cpu使用率
+        '''
+        total, idle = self.cpu_times()
+        last_total, last_idle = self.last
+        self.last = total, idle
+        if total <= last_total:
+            return 0.0
+        busy = (total - last_total) - (idle - last_idle)
+        return round(min(max(busy / (total - last_total) * 100, 0.0), 100.0), 1)
+
+
+def sample_server(cpu_sampler):
+    '''
+    获取当前cpu使用率和内存使用率，cpu使用率为距该采集器上次调用期间的平均值
+    :param cpu_sampler: 调用方的cpu使用率采集器
+    :return: cpu使用率和内存使用率
+    '''
+    return cpu_sampler.percent(), psutil.virtual_memory().percent
+
+
+def record_sample(cpu, mem, timestamp=None):
+    '''
+    写入一次采样数据，各精度按所在时间段累加，写入位置由时间戳对缓冲区大小取模得到，旧数据被直接覆盖
+    :param cpu: cpu使用率
+    :param mem: 内存使用率
+    :param timestamp: 采样时间戳，默认为当前时间
+    :return:
+    '''
+    timestamp = int(timestamp or time.time())
+    positions = []
+    pipe = REDIS_CLIENT.pipeline(transaction=False)
+    for tier, (step, size) in METRICS_TIERS.items():
+        bucket = timestamp - timestamp % step
+        offset = bucket // step % size * SLOT.size
+        positions.append((tier, bucket, offset))
+        pipe.getrange(tier_key(tier), offset, offset + SLOT.size - 1)
+    for (tier, bucket, offset), raw in zip(positions, pipe.execute()):
+        cpu_sum, mem_sum, count = cpu, mem, 1
+        # 同一时间段内已有数据则累加，否则覆盖上一轮的旧数据，已被更新的数据覆盖的过期采样直接丢弃
+        if len(raw) == SLOT.size:
+            start, old_cpu, old_mem, old_count = SLOT.unpack(raw)
+            if start > bucket:
+                continue
+            if start == bucket:
+                cpu_sum, mem_sum, count = old_cpu + cpu, old_mem + mem, old_count + 1
+        pipe.setrange(tier_key(tier), offset, SLOT.pack(bucket, cpu_sum, mem_sum, count))
+    pipe.execute()
+
+
+def get_history(range_type):
+    '''
+    获取服务器历史数据
+    :param range_type: 数据范围，hour、day、week或month
+    :return: 按时间排序的数据点列表
+    '''
+    tier, span = HISTORY_RANGES.get(range_type, HISTORY_RANGES['hour'])
+    raw = REDIS_CLIENT.get(tier_key(tier)) or b''
+    start_time = time.time() - span
+    points = []
+    for start, cpu_sum, mem_sum, count in SLOT.iter_unpack(raw[:len(raw) - len(raw) % SLOT.size]):
+        # 跳过未写入的位置和超出范围的旧数据
+        if count and start >= start_time:
+            points.append((start, cpu_sum / count, mem_sum / count))
+    points.sort()
+    return [{
+        'time': datetime.datetime.fromtimestamp(start).strftime('%Y-%m-%d %H:%M:%S'),
+        'cpu': round(cpu, 1),
+        'mem': round(mem, 1)
+    } for start, cpu, mem in points]
@@ -0,0 +1,100 @@
+from utils.constant import REDIS_CLIENT
+
+# 用户登录记录脚本，在redis服务端一次完成登录排行、登录方式计数、token续期判断和token写入
+# KEYS[1]登录排行榜 KEYS[2]登录方式计数 KEYS[3]已校验属于当前用户的旧token，没有时为空 KEYS[4]新生成的token
+# ARGV[1]用户标识 ARGV[2]排行榜和计数有效期 ARGV[3]token有效期 ARGV[4]序列化后的用户信息
+# ARGV[5]校验旧token时读取的数据，旧token的数据在校验后被修改或已过期时不再沿用
+LOGIN_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    redis.call('ZADD', KEYS[1], 1, ARGV[1])
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+else
+    redis.call('ZINCRBY', KEYS[1], 1, ARGV[1])
+    if redis.call('ZCARD', KEYS[1]) > 10 then
+        redis.call('ZREMRANGEBYRANK', KEYS[1], 0, -11)
+    end
+end
+redis.call('SET', KEYS[2], 0, 'EX', ARGV[2], 'NX')
+redis.call('INCR', KEYS[2])
+local reuse = 0
+if KEYS[3] ~= '' and redis.call('GET', KEYS[3]) == ARGV[5] and redis.call('TTL', KEYS[3]) > 0 then
+    reuse = 1
+end
+redis.call('SET', KEYS[4 - reuse], ARGV[4], 'EX', ARGV[3])
+return reuse
+"""
+LOGIN_SCRIPT = REDIS_CLIENT.register_script(LOGIN_LUA)
+
+# 评价汇总增量更新脚本，只更新已构建的汇总，未构建的汇总在读取时从数据库重建
+# 汇总正在重建时删除重建标记，使本次重建结果作废，避免重建写入不包含本次变更的旧计数
+# KEYS为需要更新的汇总键 ARGV[1]计数字段 ARGV[2]增量
+ROLLUP_INCR_LUA = """
+for _, key in ipairs(KEYS) do
+    if redis.call('HEXISTS', key, '_built') == 1 then
+        redis.call('HINCRBY', key, ARGV[1], ARGV[2])
+    else
+        redis.call('HDEL', key, '_building')
+    end
+end
+return 1
+"""
+ROLLUP_INCR_SCRIPT = REDIS_CLIENT.register_script(ROLLUP_INCR_LUA)
+
+# 评价汇总开始重建脚本，汇总未构建时写入重建标记
+# KEYS[1]汇总键 ARGV[1]本次重建的标记值 ARGV[2]重建标记的有效期
+# 返回1表示可以开始重建，0表示汇总已被其他进程构建完成
+ROLLUP_BEGIN_LUA = """
+if redis.call('HEXISTS', KEYS[1], '_built') == 1 then
+    return 0
+end
+redis.call('HSET', KEYS[1], '_building', ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+ROLLUP_BEGIN_SCRIPT = REDIS_CLIENT.register_script(ROLLUP_BEGIN_LUA)
+
+# 评价汇总写入脚本，重建标记未被增量更新删除时才写入统计结果
+# KEYS[1]汇总键 ARGV[1]本次重建的标记值 ARGV[2]汇总有效期 ARGV[3:]计数字段和计数
+# 返回1表示写入成功，0表示重建期间数据发生了变化，本次结果作废
+ROLLUP_COMMIT_LUA = """
+if redis.call('HGET', KEYS[1], '_building') ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], '_built', 1, unpack(ARGV, 3))
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+ROLLUP_COMMIT_SCRIPT = REDIS_CLIENT.register_script(ROLLUP_COMMIT_LUA)
+
+# 令牌桶限流脚本，按时间补充令牌，有令牌时取出一个并允许执行
+# KEYS[1]令牌桶 ARGV[1]桶容量 ARGV[2]补充一个令牌的时间(毫秒) ARGV[3]当前时间(毫秒)
+# 返回是否允许执行以及距离下一个令牌的等待时间(毫秒)
+TOKEN_BUCKET_LUA = """
+local capacity = tonumber(ARGV[1])
+local interval = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'time')
+local tokens = tonumber(bucket[1]) or capacity
+local last = tonumber(bucket[2]) or now
+local refill = math.floor((now - last) / interval)
+if refill > 0 then
+    tokens = math.min(capacity, tokens + refill)
+    last = last + refill * interval
+end
+if tokens >= capacity then
+    last = now
+end
+local allowed = 0
+local wait = 0
+if tokens > 0 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    wait = interval - (now - last)
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'time', last)
+redis.call('PEXPIRE', KEYS[1], capacity * interval)
+return {allowed, wait}
+"""
+TOKEN_BUCKET_SCRIPT = REDIS_CLIENT.register_script(TOKEN_BUCKET_LUA)
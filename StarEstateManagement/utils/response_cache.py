@@ -0,0 +1,117 @@
+import hashlib
+from functools import wraps
+
+import ujson
+from django.conf import settings
+from django.http import HttpResponseNotModified
+from rest_framework import status
+from rest_framework.response import Response
+from utils.async_redis import get_async_redis
+from utils.constant import REDIS_CLIENT, REDIS_SAVE_TIME
+from utils.data_version import get_version, version_key
+
+# 响应缓存的保存时间，数据版本变化后旧缓存不再被读取，到期后自动删除
+RESPONSE_CACHE_TIME = getattr(settings, 'RESPONSE_CACHE_TIME', REDIS_SAVE_TIME)
+
+
+def response_key(name, version):
+    '''
+    获取响应缓存的redis键名
+    :param name: 接口名称
+    :param version: 数据版本号
+    :return: 键名
+    '''
+    return f'response:{name}:{version}'
+
+
+def make_etag(name, raw):
+    '''
+    根据接口名称和响应内容的哈希生成ETag，内容不变时ETag不变
+    数据版本号在redis重启或键被淘汰后会从0重新计数，不能单独作为ETag，否则不同内容可能得到相同的ETag
+    :param name: 接口名称
+    :param raw: json编码的响应数据
+    :return: ETag
+    '''
+    if isinstance(raw, str):
+        raw = raw.encode()
+    return f'"{name}-{hashlib.md5(raw).hexdigest()[:16]}"'
+
+
+def etag_matches(if_none_match, etag):
+    '''
+    判断请求头If-None-Match是否包含当前ETag
+    :param if_none_match: 请求头If-None-Match的值
+    :param etag: 当前ETag
+    :return: 是否匹配
+    '''
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    # 弱校验，忽略W/前缀
+    return '*' in tags or etag in [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+
+
+def not_modified(etag):
+    '''
+    数据未变化时返回不含响应体的304响应
+    :param etag: 当前ETag
+    :return: 响应对象
+    '''
+    response = HttpResponseNotModified()
+    response['ETag'] = etag
+    return response
+
+
+def version_cache(name, model):
+    '''
+    按数据版本缓存视图响应数据，数据模型变更后版本号+1，缓存随之失效
+    请求携带的If-None-Match与缓存内容的ETag一致时直接返回304，不查询数据库
+    :param name: 接口名称
+    :param model: 响应数据依赖的数据模型
+    :return: 装饰器
+    '''
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, request, *args, **kwargs):
+            version = get_version(model)
+            raw = REDIS_CLIENT.get(response_key(name, version))
+            response = None
+            if raw is None:
+                response = func(self, request, *args, **kwargs)
+                # 只缓存成功的响应
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                raw = ujson.dumps(response.data)
+                REDIS_CLIENT.set(response_key(name, version), raw, ex=RESPONSE_CACHE_TIME)
+            etag = make_etag(name, raw)
+            if etag_matches(request.META.get('HTTP_IF_NONE_MATCH'), etag):
+                return not_modified(etag)
+            if response is None:
+                response = Response(ujson.loads(raw))
+            response['ETag'] = etag
+            return response
+        return wrapper
+    return decorator
+
+
+async def aget_cached_data(request, name, model, build):
+    '''
+    异步视图使用的版本缓存，与同步接口共用缓存数据
+    :param request: 请求对象
+    :param name: 接口名称
+    :param model: 响应数据依赖的数据模型
+    :param build: 缓存未命中时生成响应数据的协程函数
+    :return: ETag和响应数据，数据未变化时响应数据为None
+    '''
+    client = get_async_redis()
+    version = int(await client.get(version_key(model)) or 0)
+    raw = await client.get(response_key(name, version))
+    data = None
+    if raw is None:
+        data = await build()
+        raw = ujson.dumps(data)
+        await client.set(response_key(name, version), raw, ex=RESPONSE_CACHE_TIME)
+    etag = make_etag(name, raw)
+    if etag_matches(request.META.get('HTTP_IF_NONE_MATCH'), etag):
+        return etag, None
+    return etag, data if data is not None else ujson.loads(raw)
@@ -1,7 +1,15 @@
 from collections import OrderedDict
+
+import ujson
+from django.conf import settings
 from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
 from rest_framework.utils.serializer_helpers import ReturnDict
 
+# 是否使用ujson直接编码响应数据，关闭时使用DRF默认的json编码
+FAST_JSON_RENDER = getattr(settings, 'FAST_JSON_RENDER', True)
+
+
 class CustomRenderer(JSONRenderer):
     """
     json响应渲染类
@@ -27,10 +35,17 @@ class CustomRenderer(JSONRenderer):
                 ret["data"] = data
             # 多条数据返回
             elif isinstance(data, OrderedDict):
-                ret["data"] = {
-                    "total": data.get("count"),
-                    "list": data.get("results")
-                }
+                # 游标分页没有总数，返回下一页游标
+                if "count" not in data and "next" in data:
+                    ret["data"] = {
+                        "list": data.get("results"),
+                        "next": data.get("next")
+                    }
+                else:
+                    ret["data"] = {
+                        "total": data.get("count"),
+                        "list": data.get("results")
+                    }
             # 如果响应数据有文本则写入data
             elif data:
                 # 如果包含token则写入data
@@ -38,6 +53,26 @@ class CustomRenderer(JSONRenderer):
                     ret["token"] = data.pop("token")
                 else:
                     ret['data'] = data
+            # 需要缩进输出时(如可浏览API)使用DRF默认的编码
+            if FAST_JSON_RENDER and not self.get_indent(accepted_media_type, renderer_context):
+                try:
+                    return self.fast_render(ret)
+                except (TypeError, OverflowError, ValueError):
+                    pass
             return super().render(ret, accepted_media_type, renderer_context)
 
-
+    def fast_render(self, data):
+        """
+        使用ujson编码响应数据，解析后的数据与DRF默认编码一致
+        浮点数的文本格式可能不同，如1e-7在DRF默认编码中为1e-07，可使用bench_renderer命令检查
+        ujson不支持的类型(datetime、UUID等)交给DRF的编码器处理，无法编码时由调用方回退到默认编码
+        :param data: 响应数据
+        :return: utf-8编码的json数据
+        """
+        ret = ujson.dumps(
+            data, ensure_ascii=self.ensure_ascii, escape_forward_slashes=False,
+            allow_nan=not api_settings.STRICT_JSON, default=self.encoder_class().default
+        )
+        # 与DRF一致，转义在javascript中非法的行分隔符和段分隔符
+        ret = ret.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029')
+        return ret.encode()
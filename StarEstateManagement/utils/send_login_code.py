@@ -1,15 +1,49 @@
+import threading
+
 from django.conf import settings
 from alibabacloud_dysmsapi20170525.client import Client as Dysmsapi20170525Client
 from alibabacloud_tea_openapi import models as open_api_models
 from alibabacloud_dysmsapi20170525 import models as dysmsapi_20170525_models
 from alibabacloud_tea_util import models as util_models
-from alibabacloud_tea_util.client import Client as UtilClient
+
+
+class SmsSendError(Exception):
+    """
+    短信网关返回发送失败
+    """
+
+
+def check_response(response):
+    '''
+    检查短信网关的返回结果，发送失败时抛出异常
+    :param response: 短信接口的返回对象
+    :return:
+    '''
+    body = response.body
+    if body.code != 'OK':
+        raise SmsSendError(f'{body.code}: {body.message}')
 
 
 class SendSms:
+    # 进程内复用的短信客户端
+    client = None
+    client_lock = threading.Lock()
+
     def __init__(self):
         pass
 
+    @classmethod
+    def get_client(cls) -> Dysmsapi20170525Client:
+        """
+        获取复用的短信客户端，每个进程只创建一次
+        @return: Client
+        """
+        if cls.client is None:
+            with cls.client_lock:
+                if cls.client is None:
+                    cls.client = cls.create_client(settings.ACCESSKEY_ID, settings.ACCESSKEY_SECRET)
+        return cls.client
+
     @staticmethod
     def create_client(
             access_key_id: str,
@@ -34,7 +68,7 @@ class SendSms:
 
     @staticmethod
     def main(phone, code, *args, **kwargs) -> None:
-        client = SendSms.create_client(settings.ACCESSKEY_ID, settings.ACCESSKEY_SECRET)
+        client = SendSms.get_client()
         code_dict = {'code': code}
         send_sms_request = dysmsapi_20170525_models.SendSmsRequest(
             phone_numbers=phone,
@@ -43,18 +77,14 @@ class SendSms:
             template_param=str(code_dict)
         )
         runtime = util_models.RuntimeOptions()
-        try:
-            # 复制代码运行请自行打印 API 的返回值
-            res = client.send_sms_with_options(send_sms_request, runtime)
-        except Exception as error:
-            # 如有需要，请打印 error
-            UtilClient.assert_as_string(error.message)
+        # 请求异常和网关返回的发送失败都交给调用方处理
+        check_response(client.send_sms_with_options(send_sms_request, runtime))
 
     @staticmethod
     async def main_async(
             phone, code, *args, **kwargs
     ) -> None:
-        client = SendSms.create_client(settings.ACCESSKEY_ID, settings.ACCESSKEY_SECRET)
+        client = SendSms.get_client()
         code_dict = {'code': code}
         send_sms_request = dysmsapi_20170525_models.SendSmsRequest(
             phone_numbers=phone,
@@ -63,10 +93,21 @@ class SendSms:
             template_param=str(code_dict)
         )
         runtime = util_models.RuntimeOptions()
-        try:
-            # 复制代码运行请自行打印 API 的返回值
-            await client.send_sms_with_options_async(send_sms_request, runtime)
-        except Exception as error:
-            # 如有需要，请打印 error
-            UtilClient.assert_as_string(error.message)
+        # 请求异常和网关返回的发送失败都交给调用方处理
+        check_response(await client.send_sms_with_options_async(send_sms_request, runtime))
+
+
+class FakeSendSms:
+    """
+    本地短信网关，只记录发送的短信不实际发送，用于开发和测试
+    """
+    # 已发送的短信，元素为(手机号, 验证码)
+    outbox = []
 
+    @staticmethod
+    def main(phone, code, *args, **kwargs) -> None:
+        FakeSendSms.outbox.append((phone, code))
+
+    @staticmethod
+    async def main_async(phone, code, *args, **kwargs) -> None:
+        FakeSendSms.outbox.append((phone, code))
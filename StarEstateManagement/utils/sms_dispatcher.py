@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import threading
+import time
+
+from django.conf import settings
+from utils.redis_script import TOKEN_BUCKET_SCRIPT
+from utils.send_login_code import SendSms, FakeSendSms
+
+# 短信网关，aliyun为阿里云短信服务，fake为只记录不发送的本地网关
+SMS_GATEWAYS = {
+    'aliyun': SendSms,
+    'fake': FakeSendSms,
+}
+SMS_GATEWAY = SMS_GATEWAYS[getattr(settings, 'SMS_GATEWAY', 'aliyun')]
+# 同时发送的最大短信数
+SMS_CONCURRENCY = getattr(settings, 'SMS_CONCURRENCY', 10)
+# 每个手机号的令牌桶容量及补充一个令牌的时间(秒)，默认最多连续发送3条，之后每60秒可再发送1条
+SMS_BUCKET_CAPACITY = getattr(settings, 'SMS_BUCKET_CAPACITY', 3)
+SMS_BUCKET_INTERVAL = getattr(settings, 'SMS_BUCKET_INTERVAL', 60)
+# 验证码有效期
+SMS_CODE_TIME = 60
+
+logger = logging.getLogger(__name__)
+
+
+def code_key(phone):
+    '''
+    获取手机号验证码的缓存键名
+    :param phone: 手机号
+    :return: 键名
+    '''
+    return f'code:{phone}'
+
+
+def acquire_send(phone):
+    '''
+    从手机号的令牌桶中取出一个令牌
+    :param phone: 手机号
+    :return: 是否允许发送，以及不允许时需要等待的秒数
+    '''
+    allowed, wait = TOKEN_BUCKET_SCRIPT(
+        keys=[f'sms_bucket:{phone}'],
+        args=[SMS_BUCKET_CAPACITY, SMS_BUCKET_INTERVAL * 1000, int(time.time() * 1000)]
+    )
+    return bool(allowed), (int(wait) + 999) // 1000
+
+
+class SmsDispatcher(object):
+    """
+    短信发送队列，在独立线程的事件循环中异步发送短信，请求线程提交后立即返回
+    """
+
+    def __init__(self, gateway, concurrency):
+        self.gateway = gateway
+        self.concurrency = concurrency
+        self.loop = None
+        self.semaphore = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        '''
+        启动事件循环线程，每个进程只启动一次
+        :return:
+        '''
+        with self.lock:
+            if self.loop is not None:
+                return
+            self.loop = asyncio.new_event_loop()
+            # 限制同时发送的短信数
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+            threading.Thread(target=self.loop.run_forever, name='sms', daemon=True).start()
+
+    async def dispatch(self, phone, code):
+        '''
+        在并发限制内调用短信网关发送短信
+        :param phone: 手机号
+        :param code: 验证码
+        :return:
+        '''
+        async with self.semaphore:
+            await self.gateway.main_async(phone, code)
+
+    @staticmethod
+    def log_result(phone, future):
+        '''
+        发送任务完成后记录发送失败的短信，请求线程不等待发送结果
+        :param phone: 手机号
+        :param future: 发送任务的future对象
+        :return:
+        '''
+        if future.cancelled():
+            logger.warning('sms to %s cancelled', phone)
+            return
+        error = future.exception()
+        if error is not None:
+            # 阿里云sdk的异常信息在message属性中，其他异常直接使用异常本身
+            logger.error('sms to %s failed: %s', phone, getattr(error, 'message', None) or repr(error),
+                         exc_info=error)
+
+    def send(self, phone, code):
+        '''
+        提交短信发送任务
+        :param phone: 手机号
+        :param code: 验证码
+        :return: 发送任务的future对象
+        '''
+        if self.loop is None:
+            self.start()
+        future = asyncio.run_coroutine_threadsafe(self.dispatch(phone, code), self.loop)
+        future.add_done_callback(lambda f: self.log_result(phone, f))
+        return future
+
+
+dispatcher = SmsDispatcher(SMS_GATEWAY, SMS_CONCURRENCY)
@@ -0,0 +1,187 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from PIL import Image
+from django.conf import settings
+from utils.constant import REDIS_CLIENT
+
+# 存储后端，oss为阿里云对象存储，local为本地文件系统
+STORAGE_BACKEND = getattr(settings, 'STORAGE_BACKEND', 'oss')
+# 图片尺寸，键为文件名后缀，值为最长边的像素数
+IMAGE_VARIANTS = {
+    'thumb': 200,
+    'display': 1080,
+}
+# 上传状态的保存时间
+UPLOAD_SAVE_TIME = 60 * 60
+# 等待上传的最大任务数，超过时在当前请求中直接上传
+UPLOAD_QUEUE_SIZE = getattr(settings, 'UPLOAD_QUEUE_SIZE', 100)
+# 后台上传线程池，限制同时执行的上传任务数
+executor = ThreadPoolExecutor(max_workers=getattr(settings, 'UPLOAD_WORKERS', 4), thread_name_prefix='upload')
+queue_slots = threading.BoundedSemaphore(UPLOAD_QUEUE_SIZE)
+
+
+class OssStorage(object):
+    """
+    阿里云对象存储，文件保存在media目录下
+    """
+    prefix = 'media/'
+
+    def __init__(self):
+        from utils.aliyun_oss import bucket
+        self.bucket = bucket
+
+    def exists(self, name):
+        return self.bucket.object_exists(self.prefix + name)
+
+    def save(self, name, data):
+        self.bucket.put_object(self.prefix + name, data)
+
+    def url(self, name):
+        return settings.OSS_HTTPS_URL + self.prefix + name
+
+
+class LocalStorage(object):
+    """
+    本地文件存储，用于开发和测试
+    """
+
+    def __init__(self):
+        self.root = getattr(settings, 'MEDIA_ROOT', '') or os.path.join(settings.BASE_DIR, 'media')
+        self.base_url = getattr(settings, 'MEDIA_URL', '/media/')
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def exists(self, name):
+        return os.path.exists(self.path(name))
+
+    def save(self, name, data):
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写入临时文件，写完后再重命名，避免读取到不完整的文件
+        with open(path + '.part', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.part', path)
+
+    def url(self, name):
+        return self.base_url + name
+
+
+STORAGE_CLASSES = {
+    'oss': OssStorage,
+    'local': LocalStorage,
+}
+_storage = None
+
+
+def get_storage():
+    '''
+    获取配置的存储后端，每个进程只创建一次
+    :return: 存储后端对象
+    '''
+    global _storage
+    if _storage is None:
+        _storage = STORAGE_CLASSES[STORAGE_BACKEND]()
+    return _storage
+
+
+def upload_key(name):
+    '''
+    获取上传状态的redis键名
+    :param name: 文件名
+    :return: 键名
+    '''
+    return f'upload:{name}'
+
+
+def get_upload_status(name):
+    '''
+    获取图片的上传状态
+    :param name: 原尺寸图片的文件名，即上传接口返回的upload_id
+    :return: pending上传中、done已完成、failed上传失败，没有上传记录或记录已过期时为None
+    '''
+    status = REDIS_CLIENT.get(upload_key(name))
+    return status.decode() if status is not None else None
+
+
+def resize_image(data, size, image_format):
+    '''
+    按比例缩小图片，图片本身小于指定尺寸时不处理
+    :param data: 图片数据
+    :param size: 最长边的像素数
+    :param image_format: 图片格式，PNG或JPEG
+    :return: 缩小后的图片数据
+    '''
+    image = Image.open(BytesIO(data))
+    if max(image.size) <= size:
+        return data
+    image.thumbnail((size, size))
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    output = BytesIO()
+    image.save(output, format=image_format)
+    return output.getvalue()
+
+
+def run_upload(names, data, image_format):
+    '''
+    生成各尺寸图片并上传，已存在的文件不重复上传
+    :param names: 各尺寸对应的文件名
+    :param data: 原图数据
+    :param image_format: 图片格式
+    :return:
+    '''
+    storage = get_storage()
+    try:
+        for variant, name in names.items():
+            if not storage.exists(name):
+                storage.save(name, resize_image(data, IMAGE_VARIANTS[variant], image_format))
+        REDIS_CLIENT.set(upload_key(names['display']), 'done', ex=UPLOAD_SAVE_TIME)
+    except Exception:
+        REDIS_CLIENT.set(upload_key(names['display']), 'failed', ex=UPLOAD_SAVE_TIME)
+
+
+def run_queued_upload(names, data, image_format):
+    '''
+    后台线程执行上传，完成后释放等待队列的位置
+    :return:
+    '''
+    try:
+        run_upload(names, data, image_format)
+    finally:
+        queue_slots.release()
+
+
+def upload_image(file, directory):
+    '''
+    上传图片，以内容哈希作为文件名，相同图片只上传一次，上传在后台线程中执行
+    返回的访问地址在状态为done之后才可以访问，状态为pending时需要根据upload_id轮询上传状态
+    :param file: 上传的文件对象
+    :param directory: 保存目录
+    :return: 各尺寸图片的访问地址、上传状态和upload_id
+    '''
+    image_format, extension = ('PNG', '.png') if file.content_type == 'image/png' else ('JPEG', '.jpg')
+    data = file.read()
+    digest = hashlib.sha256(data).hexdigest()[:32]
+    names = {variant: f'{directory}/{digest}_{variant}{extension}' for variant in IMAGE_VARIANTS}
+    storage = get_storage()
+    result = {variant: storage.url(name) for variant, name in names.items()}
+    result['upload_id'] = names['display']
+    # 同一图片已上传或正在上传时直接返回
+    if not REDIS_CLIENT.set(upload_key(names['display']), 'pending', nx=True, ex=UPLOAD_SAVE_TIME):
+        status = (REDIS_CLIENT.get(upload_key(names['display'])) or b'failed').decode()
+        if status != 'failed':
+            result['status'] = status
+            return result
+        REDIS_CLIENT.set(upload_key(names['display']), 'pending', ex=UPLOAD_SAVE_TIME)
+    # 等待上传的任务过多时在当前请求中直接上传
+    if queue_slots.acquire(blocking=False):
+        executor.submit(run_queued_upload, names, data, image_format)
+    else:
+        run_upload(names, data, image_format)
+    result['status'] = (REDIS_CLIENT.get(upload_key(names['display'])) or b'pending').decode()
+    return result
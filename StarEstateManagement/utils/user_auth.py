@@ -1,10 +1,217 @@
+import threading
+import time
+from collections import OrderedDict
+
 import ujson
+from django.conf import settings
 from django.core.cache import cache
 from rest_framework import exceptions
 from django.utils.translation import gettext_lazy as _
 from rest_framework.authentication import TokenAuthentication
 
-from star_db.models import User
+from utils.async_redis import get_async_redis
+from utils.constant import REDIS_CLIENT
+
+# 进程内token缓存的最大条数和有效期(秒)，有效期决定了订阅失效时缓存数据最长的过期时间
+TOKEN_CACHE_SIZE = getattr(settings, 'TOKEN_CACHE_SIZE', 1024)
+TOKEN_CACHE_TIMEOUT = getattr(settings, 'TOKEN_CACHE_TIMEOUT', 30)
+# token失效通知的发布订阅频道
+TOKEN_CHANNEL = 'token_invalidate'
+
+
+class TokenPrincipal(object):
+    """
+    token对应的轻量用户对象，只包含认证和权限判断需要的字段
+    """
+    __slots__ = ('pk', 'group', 'username', 'name', 'avatar')
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, pk, group, username, name, avatar):
+        self.pk = pk
+        self.group = group
+        self.username = username
+        self.name = name
+        self.avatar = avatar
+
+    @property
+    def id(self):
+        return self.pk
+
+    def __str__(self):
+        return self.username
+
+
+class TokenCache(object):
+    """
+    进程内token缓存，按最近使用顺序淘汰，通过redis订阅接收其他进程的失效通知
+    """
+
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def get(self, key):
+        '''
+        获取未过期的用户对象
+        :param key: token
+        :return: 用户对象，不存在或已过期时为None
+        '''
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            principal, expire = item
+            if expire < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return principal
+
+    def set(self, key, principal):
+        '''
+        缓存用户对象，超出容量时淘汰最久未使用的数据
+        :param key: token
+        :param principal: 用户对象
+        :return:
+        '''
+        with self._lock:
+            self._data[key] = (principal, time.monotonic() + self.timeout)
+            self._data.move_to_end(key)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        '''
+        删除缓存的用户对象
+        :param key: token
+        :return:
+        '''
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def listen(self):
+        '''
+        启动订阅线程接收token失效通知，每个进程只启动一次
+        :return:
+        '''
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            pubsub = REDIS_CLIENT.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{TOKEN_CHANNEL: self.handle_message})
+            self._thread = pubsub.run_in_thread(sleep_time=1, daemon=True, exception_handler=self.handle_error)
+
+    def handle_message(self, message):
+        '''
+        处理失效通知，删除对应token的缓存
+        :param message: 订阅消息
+        :return:
+        '''
+        key = message.get('data')
+        self.delete(key.decode() if isinstance(key, bytes) else key)
+
+    def handle_error(self, error, pubsub, thread):
+        '''
+        订阅连接异常时停止线程并清空缓存，下次认证时重新订阅
+        :return:
+        '''
+        thread.stop()
+        pubsub.close()
+        self.clear()
+
+
+token_cache = TokenCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TIMEOUT)
+
+
+def get_token_user(key):
+    '''
+    根据token获取用户对象，优先从进程内缓存获取
+    :param key: token
+    :return: 用户对象，token无效时为None
+    '''
+    token_cache.listen()
+    principal = token_cache.get(key)
+    if principal is not None:
+        return principal
+    # 获取token的用户信息
+    user_data = cache.get(key)
+    # 如果获取不到缓存数据则说明是无效的token
+    if not user_data:
+        return None
+    return load_principal(key, user_data)
+
+
+async def aget_token_user(key):
+    '''
+    根据token获取用户对象，异步视图使用，进程内缓存未命中时通过异步redis客户端获取
+    :param key: token
+    :return: 用户对象，token无效时为None
+    '''
+    token_cache.listen()
+    principal = token_cache.get(key)
+    if principal is not None:
+        return principal
+    # token由django缓存写入，键名和值的格式与缓存保持一致
+    raw = await get_async_redis().get(cache.make_key(key))
+    if raw is None:
+        return None
+    user_data = cache._cache._serializer.loads(raw)
+    if not user_data:
+        return None
+    return load_principal(key, user_data)
+
+
+def load_principal(key, user_data):
+    '''
+    反序列化缓存数据并封装用户对象，同时写入进程内缓存
+    :param key: token
+    :param user_data: 缓存的用户信息json字符串
+    :return: 用户对象
+    '''
+    user_data = ujson.loads(user_data)
+    principal = TokenPrincipal(user_data.get('id'), user_data.get('group'), user_data.get('username'),
+                               user_data.get('name'), user_data.get('avatar'))
+    token_cache.set(key, principal)
+    return principal
+
+
+def get_token_owner(key):
+    '''
+    获取token对应的用户id及redis中保存的原始数据，用于登录时判断旧token能否沿用
+    请求头中的token不可信，键不存在或保存的不是用户信息(如其他缓存数据)时返回None
+    :param key: token
+    :return: 用户id和原始数据，无效时均为None
+    '''
+    raw = REDIS_CLIENT.get(cache.make_key(key))
+    if raw is None:
+        return None, None
+    try:
+        user_data = ujson.loads(cache._cache._serializer.loads(raw))
+    except Exception:
+        return None, None
+    if not isinstance(user_data, dict) or not isinstance(user_data.get('id'), int):
+        return None, None
+    return user_data['id'], raw
+
+
+def invalidate_token(key):
+    '''
+    通知所有进程删除token的缓存
+    :param key: token
+    :return:
+    '''
+    token_cache.delete(key)
+    REDIS_CLIENT.publish(TOKEN_CHANNEL, key)
 
 
 class UserTokenAuthentication(TokenAuthentication):
@@ -17,16 +224,9 @@ class UserTokenAuthentication(TokenAuthentication):
         :param key: token
         :return: 用户对象和token值
         """
-        # 获取token的用户信息
-        user_data = cache.get(key)
+        user = get_token_user(key)
         # 如果有数据则说明是有效的token
-        if user_data:
-            # 反序列化缓存数据
-            user_data = ujson.loads(user_data)
-            # 封装user对象
-            user = User()
-            for key in user_data:
-                setattr(user, key, user_data.get(key))
+        if user is not None:
             return user, key
         # 如果获取不到缓存数据则说明是无效的token
         raise exceptions.AuthenticationFailed(_('Invalid token.'))